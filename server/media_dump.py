@@ -19,17 +19,32 @@ output/
   video_all_urls.txt / video_urls.txt / video_errors.txt
 """
 
+import asyncio
 import os
 import re
 import hashlib
+import queue
+from collections import Counter, OrderedDict, defaultdict
 import subprocess
 import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit, urljoin
 from mitmproxy import http
 
 import requests
+from requests.adapters import HTTPAdapter
+
+# 可选：装了 pillow-avif-plugin 时静态 AVIF 走进程内解码，省掉 ffmpeg 启动开销
+try:
+    from PIL import Image
+    import pillow_avif  # noqa: F401  注册 AVIF 解码器
+    HAS_PIL_AVIF = True
+except ImportError:
+    HAS_PIL_AVIF = False
 
 # =======================================================
 # 证书模式A：使用 mitmproxy CA 给 requests.verify
@@ -55,6 +70,15 @@ if not MITM_CA:
         "未找到 mitmproxy CA：请确认已生成证书。应存在于 ~/.mitmproxy/ 下，如 mitmproxy-ca-cert.pem"
     )
 
+# =======================================================
+# 共享 HTTP 会话：连接池复用，省掉每个分片/直链的 TCP+TLS 握手
+# =======================================================
+SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+SESSION.mount("http://", _ADAPTER)
+SESSION.mount("https://", _ADAPTER)
+
+
 def verify_for_url(url: str):
     """
     模式A：requests 走 mitmproxy 代理，因此对被 MITM 的站点用 mitmproxy CA 校验。
@@ -103,46 +127,164 @@ for d in [
     os.makedirs(d, exist_ok=True)
 
 
+# =======================================================
+# 预编译正则（热路径：每个 flow 都会经过这些判断）
+# =======================================================
+_IMG_EXT_RE = re.compile(r"\.(jpg|jpeg|png|gif|bmp|webp|avif|heic|svg)(\?|$)", re.IGNORECASE)
+# 扩展名 + 关键词（tplv / 微信 / 头像 / 自有域名）合并成一条 alternation，URL 只扫一遍
+_IMG_HINT_RE = re.compile(
+    r"\.(?:jpg|jpeg|png|gif|bmp|webp|avif|heic|svg)(?:\?|$)"
+    r"|tplv|mmbiz|qlogo\.cn|pb\.plusx\.cn"
+)
+_IMG_BLOCK_RE = re.compile(r"hm\.baidu\.com/hm\.gif")
+_ORIG_NAME_RE = re.compile(r"(DSC|IMGS|IMG|PXL|photo|mmexport)[A-Za-z0-9_-]+\.", re.IGNORECASE)
+# 上面正则的廉价前置判断：startswith(tuple) 是 C 级快路径
+_ORIG_NAME_PFX = ("dsc", "imgs", "img", "pxl", "photo", "mmexport")
+_CAND_NAME_RE = re.compile(r"[A-Za-z0-9_-]{3,}")
+_SANITIZE_RE = re.compile(r'[\\/:*?"<>|]')
+_MP4_URL_RE = re.compile(r"\.mp4(\?|$)", re.IGNORECASE)
+_TPLV_SPLIT_RE = re.compile(r"[\*~]tplv")
+
+
 # =======================================================
 # URL 去重（按“路径”去重，忽略 query）
 # =======================================================
-SEEN_IMAGE_URL = set()
-SEEN_IMAGE_ALL_URL = set()
+class LRUSet:
+    """有界去重集合：超出容量按插入顺序淘汰最老的 key，长会话内存不再无限增长。"""
+
+    def __init__(self, cap: int):
+        self.cap = cap
+        self._d = OrderedDict()
+
+    def add(self, key) -> bool:
+        """首次见到返回 True；已存在返回 False（并刷新为最新）。"""
+        if key in self._d:
+            self._d.move_to_end(key)
+            return False
+        self._d[key] = None
+        if len(self._d) > self.cap:
+            self._d.popitem(last=False)
+        return True
+
+    def __contains__(self, key) -> bool:
+        return key in self._d
+
+    def __len__(self) -> int:
+        return len(self._d)
 
-SEEN_VIDEO_URL = set()       # m3u8/mpd 去重
-SEEN_VIDEO_ALL_URL = set()
 
-SEEN_MP4_URL = set()         # mp4 直链去重（按路径）
+SEEN_CAP = 100_000
+
+SEEN_IMAGE_URL = LRUSet(SEEN_CAP)
+SEEN_IMAGE_ALL_URL = LRUSet(SEEN_CAP)
+
+SEEN_VIDEO_URL = LRUSet(SEEN_CAP)       # m3u8/mpd 去重
+SEEN_VIDEO_ALL_URL = LRUSet(SEEN_CAP)
+
+SEEN_MP4_URL = LRUSet(SEEN_CAP)         # mp4 直链去重（按路径）
 
 DOWNLOADING = set()
 DOWNLOADING_LOCK = threading.Lock()
 
 
-def url_key(url: str) -> str:
-    return url.split("?", 1)[0]
+def url_key(sp) -> str:
+    """sp 为 urlsplit 结果；按 host+path 去重，忽略 query（签名轮换不影响去重）。"""
+    return sp.netloc + sp.path
 
 
 def save_binary(path, content: bytes):
-    with open(path, "wb") as f:
-        f.write(content)
+    # 单次落盘直接走 os.open/os.write，省掉 BufferedWriter/FileIO 的构造开销
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(content)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+
+# 日志句柄缓存：每个日志文件只 open 一次（行缓冲），避免每行 open/close 的系统调用开销
+_LOG_HANDLES = {}
+
+
+def _get_log(path: str):
+    f = _LOG_HANDLES.get(path)
+    if f is None:
+        f = open(path, "a", encoding="utf-8", buffering=1)
+        _LOG_HANDLES[path] = f
+    return f
+
+
+# 日志行先进内存缓冲，后台线程定时批量 writelines：热路径上零磁盘 I/O
+_LOG_FLUSH_INTERVAL = 0.5
+_LOG_MAX_BATCH = 512       # 单文件积压到该行数时立刻唤醒 flusher，限制缓冲占用
+_LOG_BUF = defaultdict(list)
+_LOG_BUF_LOCK = threading.Lock()
+_LOG_WAKE = threading.Event()
 
 
 def append_line(path: str, line: str):
-    try:
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(line.rstrip("\n") + "\n")
-    except Exception as e:
-        print(f"[LOG ERROR] {path}: {e}")
+    with _LOG_BUF_LOCK:
+        buf = _LOG_BUF[path]
+        buf.append(line.rstrip("\n") + "\n")
+        backlog = len(buf)
+    if backlog >= _LOG_MAX_BATCH:
+        _LOG_WAKE.set()
+
+
+def _flush_logs():
+    with _LOG_BUF_LOCK:
+        batches = [(p, lines[:]) for p, lines in _LOG_BUF.items() if lines]
+        for p, _ in batches:
+            _LOG_BUF[p].clear()
+
+    for p, lines in batches:
+        try:
+            _get_log(p).writelines(lines)
+        except Exception as e:
+            print(f"[LOG ERROR] {p}: {e}")
+
+
+def _log_flusher():
+    while True:
+        _LOG_WAKE.wait(_LOG_FLUSH_INTERVAL)
+        _LOG_WAKE.clear()
+        _flush_logs()
+
+
+threading.Thread(target=_log_flusher, daemon=True).start()
 
 
 # =======================================================
 # 图片相关：未解析 / 异常调试输出
+# 每种 reason 限量落盘，写入由后台线程完成，不阻塞 response 回调
 # =======================================================
+_UNPARSED_CAP = 200
+_UNPARSED_COUNT = Counter()
+_UNPARSED_Q = queue.Queue()
+
+
+def _unparsed_writer():
+    while True:
+        payload = _UNPARSED_Q.get()
+        try:
+            with open(IMAGE_UNPARSED_LOG, "a", encoding="utf-8") as f:
+                f.write(payload)
+        except Exception as e:
+            print("[UNPARSED-LOG ERROR]", e)
+        finally:
+            _UNPARSED_Q.task_done()
+
+
+threading.Thread(target=_unparsed_writer, daemon=True).start()
+
+
 def log_unparsed_image(flow: http.HTTPFlow, reason: str, extra: str = ""):
     url = flow.request.pretty_url
     headers = flow.response.headers
-    data = flow.response.content or b""
-    length = len(data)
+    data = flow.response.get_content(strict=False)
+    length = len(data) if data else 0
 
     ct = headers.get("Content-Type", "")
     imgx = headers.get("imagex-fmt", "")
@@ -151,129 +293,88 @@ def log_unparsed_image(flow: http.HTTPFlow, reason: str, extra: str = ""):
     if extra:
         print(f"               extra={extra}")
 
-    try:
-        with open(IMAGE_UNPARSED_LOG, "a", encoding="utf-8") as f:
-            f.write("\n================= UNPARSED IMAGE =================\n")
-            f.write(f"REASON      : {reason}\n")
-            if extra:
-                f.write(f"EXTRA       : {extra}\n")
-            f.write(f"URL         : {url}\n")
-            f.write(f"LENGTH      : {length}\n")
-            f.write(f"Content-Type: {ct}\n")
-            f.write(f"imagex-fmt  : {imgx}\n")
-            f.write("HEADERS:\n")
-            for k, v in headers.items():
-                f.write(f"  {k}: {v}\n")
-            f.write("==================================================\n")
-    except Exception as e:
-        print("[UNPARSED-LOG ERROR]", e)
+    _UNPARSED_COUNT[reason] += 1
+    if _UNPARSED_COUNT[reason] > _UNPARSED_CAP:
+        return
+
+    lines = ["\n================= UNPARSED IMAGE =================\n",
+             f"REASON      : {reason}\n"]
+    if extra:
+        lines.append(f"EXTRA       : {extra}\n")
+    lines.append(f"URL         : {url}\n")
+    lines.append(f"LENGTH      : {length}\n")
+    lines.append(f"Content-Type: {ct}\n")
+    lines.append(f"imagex-fmt  : {imgx}\n")
+    lines.append("HEADERS:\n")
+    for k, v in headers.items():
+        lines.append(f"  {k}: {v}\n")
+    lines.append("==================================================\n")
+
+    _UNPARSED_Q.put("".join(lines))
 
 
 # =======================================================
 # 图片候选检测 & 全量 URL 记录
+# （判定逻辑统一在 _CLASSIFY_SRC 生成的 _classify 里，见文件末尾）
 # =======================================================
-def is_image_candidate(flow: http.HTTPFlow) -> bool:
-    url = flow.request.pretty_url.lower()
-    ct = flow.response.headers.get("Content-Type", "").lower()
-
-    if "hm.baidu.com/hm.gif" in url:
-        return False
-
-    if re.search(r"\.(jpg|jpeg|png|gif|bmp|webp|avif|heic|svg)(\?|$)", url):
-        return True
-
-    if "tplv" in url:
-        return True
-
-    if ct.startswith("image/"):
-        return True
-
-    if any(x in url for x in ["mmbiz", "qlogo.cn", "mmbiz.qpic.cn", "pb.plusx.cn"]):
-        return True
-
-    return False
-
-
-def log_all_image_url(flow: http.HTTPFlow):
-    url = flow.request.pretty_url
-    key = url_key(url)
-    if key in SEEN_IMAGE_ALL_URL:
+def log_all_image_url(url: str, ct: str, key: str):
+    if not SEEN_IMAGE_ALL_URL.add(key):
         return
-    SEEN_IMAGE_ALL_URL.add(key)
 
-    ct = flow.response.headers.get("Content-Type", "").lower()
     append_line(IMAGE_ALL_LOG, f"{url}    [ct={ct}]")
 
 
 # =======================================================
 # 视频候选检测 & 全量 URL 记录（含 HLS + DASH + MP4）
 # =======================================================
-def is_video_candidate(flow: http.HTTPFlow) -> bool:
-    url = flow.request.pretty_url.lower()
-    ct = flow.response.headers.get("Content-Type", "").lower()
-
-    # HLS：m3u8
-    if url.endswith(".m3u8") or ".m3u8?" in url:
-        return True
-    if "m3u8" in url and ("api" in url or "/m3u8/" in url):
-        return True
-    if ct.startswith("application/vnd.apple.mpegurl") or ct.startswith("application/x-mpegurl"):
-        return True
+_VIDEO_EXTS = frozenset({"m3u8", "ts", "mpd", "m4s", "mp4"})
 
-    # HLS：TS
-    if url.endswith(".ts") or ".ts?" in url:
-        return True
-    if ct == "video/mp2t":
-        return True
-
-    # DASH：mpd
-    if url.endswith(".mpd") or ".mpd?" in url:
-        return True
-    if ct.startswith("application/dash+xml"):
-        return True
-
-    # DASH：m4s
-    if url.endswith(".m4s") or ".m4s?" in url:
-        return True
-    if ".m4s" in url and (ct.startswith("video/") or ct.startswith("application/octet-stream")):
-        return True
-
-    # MP4 直链
-    if ct.startswith("video/mp4") or url.endswith(".mp4") or ".mp4?" in url:
-        return True
-
-    # 泛型视频兜底
-    if ct.startswith("video/"):
-        return True
-
-    return False
 
-
-def log_all_video_url(flow: http.HTTPFlow):
-    url = flow.request.pretty_url
-    key = url_key(url)
-    if key in SEEN_VIDEO_ALL_URL:
+def log_all_video_url(url: str, ct: str, key: str):
+    if not SEEN_VIDEO_ALL_URL.add(key):
         return
-    SEEN_VIDEO_ALL_URL.add(key)
 
-    ct = flow.response.headers.get("Content-Type", "").lower()
     append_line(VIDEO_ALL_LOG, f"{url}    [ct={ct}]")
 
 
 # =======================================================
 # Magic Number 识别（图片）
 # =======================================================
+# 前 4 字节 → 扩展名的哈希表分发（替代逐条 startswith 链）
+_MAGIC_PREFIX = {
+    b"\xFF\xD8\xFF\xE0": "jpg",
+    b"\xFF\xD8\xFF\xE1": "jpg",
+    b"\xFF\xD8\xFF\xDB": "jpg",
+    b"\xFF\xD8\xFF\xEE": "jpg",
+    b"\x89PNG": "png",
+    b"GIF8": "gif",
+}
+
+# ISO-BMFF（ftyp box）品牌 → 扩展名
+# key 为品牌 8 字节的小端整数：一次 64 位比较，免去逐字节 memcmp
+_FTYP_BRANDS = {
+    int.from_bytes(brand, "little"): ext
+    for brand, ext in (
+        (b"ftypavif", "avif"),
+        (b"ftypheic", "heic"),
+        (b"ftypheif", "heic"),
+    )
+}
+
+
 def detect_magic_ext(data: bytes):
+    ext = _MAGIC_PREFIX.get(data[:4])
+    if ext:
+        # GIF 需要再确认 87a/89a 版本号
+        if ext == "gif" and data[4:6] not in (b"7a", b"9a"):
+            return None
+        return ext
+    # 少见的 JPEG APP 段标记兜底
     if data.startswith(b"\xFF\xD8\xFF"):
         return "jpg"
-    if data.startswith(b"\x89PNG\r\n\x1a\n"):
-        return "png"
-    if data.startswith(b"GIF87a") or data.startswith(b"GIF89a"):
-        return "gif"
-    if len(data) >= 12 and data[4:12] == b"ftypavif":
-        return "avif"
-    if len(data) >= 12 and data[4:12] in (b"ftypheic", b"ftypheif"):
-        return "heic"
+    if len(data) >= 12:
+        with memoryview(data) as mv:
+            return _FTYP_BRANDS.get(int.from_bytes(mv[4:12], "little"))
     return None
 
 
@@ -309,16 +410,15 @@ def ext_from_imagex_fmt(fmt: str) -> str:
     return "bin"
 
 
-def ext_from_url(url: str):
-    m = re.search(r"\.(jpg|jpeg|png|gif|bmp|webp|svg|avif|heic)(\?|$)", url, re.IGNORECASE)
+def ext_from_url(path: str):
+    m = _IMG_EXT_RE.search(path)
     if m:
         return m.group(1).lower()
     return None
 
 
-def detect_image_ext(flow: http.HTTPFlow, data: bytes) -> str:
+def detect_image_ext(flow: http.HTTPFlow, data: bytes, path: str) -> str:
     headers = flow.response.headers
-    url = flow.request.pretty_url
     content_type = headers.get("Content-Type", "").lower()
 
     fmt = headers.get("imagex-fmt")
@@ -332,38 +432,44 @@ def detect_image_ext(flow: http.HTTPFlow, data: bytes) -> str:
     if magic:
         return magic
 
-    url_ext = ext_from_url(url)
+    url_ext = ext_from_url(path)
     if url_ext:
         return url_ext
 
     return "bin"
 
 
-def extract_original_name(url: str) -> str:
-    clean = url.split("?")[0]
-    parts = clean.split("/")
+def extract_original_name(path: str) -> str:
+    parts = path.split("/")
 
     for p in parts:
-        if re.match(r"(DSC|IMGS|IMG|PXL|photo|mmexport)[A-Za-z0-9_-]+\.", p, re.IGNORECASE):
+        # 绝大多数 CDN 路径段在这里被一次 startswith 排除，不进正则
+        if not p.lower().startswith(_ORIG_NAME_PFX):
+            continue
+        if _ORIG_NAME_RE.match(p):
             return p.split(".")[0]
 
     if len(parts) > 2:
         cand = parts[-2]
-        if re.match(r"[A-Za-z0-9_-]{3,}", cand) and "tplv" not in cand:
+        if _CAND_NAME_RE.match(cand) and "tplv" not in cand:
             return cand
 
-    last = re.split(r"[\*~]tplv", parts[-1])[0]
+    last = _TPLV_SPLIT_RE.split(parts[-1])[0]
     last = last.split(".")[0]
-    if re.match(r"[A-Za-z0-9_-]{3,}", last):
+    if _CAND_NAME_RE.match(last):
         return last
 
-    h = hashlib.md5(clean.encode()).hexdigest()[:10]
+    # blake2b 比 md5 少一次 OpenSSL EVP 初始化，这里只是文件名标签，非安全用途
+    h = hashlib.blake2b(path.encode("utf-8", "surrogatepass"), digest_size=5).hexdigest()
     return f"img_{h}"
 
 
 # =======================================================
-# AVIF 动图检测 & 转换
+# AVIF 动图检测 & 转换（后台线程池，不阻塞 response 回调）
 # =======================================================
+AVIF_POOL = ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 2) // 2))
+
+
 def detect_animated_avif(path: str) -> bool:
     try:
         result = subprocess.run(
@@ -383,20 +489,36 @@ def convert_avif(path: str, name_root: str, animated: bool):
         gif_path = os.path.join(IMG_CONVERT_DIR, f"{name_root}.gif")
         jpg_path = os.path.join(IMG_CONVERT_DIR, f"{name_root}_first.jpg")
 
-        subprocess.run(["ffmpeg", "-y", "-i", path, gif_path],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        subprocess.run(["ffmpeg", "-y", "-i", path, "-vframes", "1", jpg_path],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # 一次 ffmpeg 同时产出 GIF + 首帧 JPG，省掉第二次进程启动
+        subprocess.run(
+            ["ffmpeg", "-y", "-i", path,
+             "-filter_complex", "[0:v]split=2[a][b];[a]trim=end_frame=1[j]",
+             "-map", "[j]", jpg_path,
+             "-map", "[b]", gif_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
         print(f"[AVIF→GIF] {gif_path}")
         print(f"[AVIF→JPG] {jpg_path}")
     else:
         out = os.path.join(IMG_CONVERT_DIR, f"{name_root}.jpg")
+        if HAS_PIL_AVIF:
+            # 进程内解码：同样的 libaom，免 fork/exec 和 ffmpeg 初始化
+            try:
+                with Image.open(path) as im:
+                    im.convert("RGB").save(out, "JPEG", quality=90)
+                print(f"[AVIF→JPG] {out}")
+                return
+            except Exception as e:
+                print(f"[AVIF PIL ERROR] {e}，回退 ffmpeg")
         subprocess.run(["ffmpeg", "-y", "-i", path, out],
                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         print(f"[AVIF→JPG] {out}")
 
 
+def _avif_pipeline(path: str, name_root: str):
+    convert_avif(path, name_root, detect_animated_avif(path))
+
+
 # =======================================================
 # 保存图片
 # =======================================================
@@ -410,66 +532,159 @@ DOMAIN_WHITELIST = {
 }
 
 
-def save_image(flow: http.HTTPFlow):
+def save_image(flow: http.HTTPFlow, sp, key: str):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = flow.response.get_content(strict=False)
 
     status = flow.response.status_code
     if status not in (200, 206):
         log_unparsed_image(flow, "NON_200_STATUS", f"status={status}")
         return
 
-    if len(data) < 5:
+    if not data or len(data) < 5:
         log_unparsed_image(flow, "EMPTY_OR_TOO_SMALL")
         return
 
-    k = url_key(url)
-    if k in SEEN_IMAGE_URL:
+    if not SEEN_IMAGE_URL.add(key):
         log_unparsed_image(flow, "DUPLICATE_URL")
         return
-    SEEN_IMAGE_URL.add(k)
 
     append_line(IMAGE_URL_LOG, url)
 
-    name_root = extract_original_name(url)
-    ext = detect_image_ext(flow, data)
+    name_root = extract_original_name(sp.path)
+    ext = detect_image_ext(flow, data, sp.path)
     if ext == "bin":
         log_unparsed_image(flow, "UNKNOWN_FORMAT_BIN")
         return
 
-    final_name = re.sub(r'[\\/:*?"<>|]', "_", f"{name_root}.{ext}")
+    final_name = _SANITIZE_RE.sub("_", f"{name_root}.{ext}")
     save_path = os.path.join(IMG_DIR, final_name)
     save_binary(save_path, data)
     print(f"[IMG SAVE] {save_path}  (fmt={ext}, len={len(data)})")
 
     if ext == "avif":
-        animated = detect_animated_avif(save_path)
-        convert_avif(save_path, name_root, animated)
+        AVIF_POOL.submit(_avif_pipeline, save_path, name_root)
 
 
 # =======================================================
 # HLS：m3u8 & TS
 # =======================================================
-def save_m3u8_and_download(flow: http.HTTPFlow):
+HLS_WORKERS = 8   # 并行拉取 TS 分片的线程数
+
+# 按“内容”去重：CDN 会轮换签名甚至路径，URL 去重挡不住同一条流的重复下载
+_SEEN_M3U8_HASHES = set()
+
+
+def _m3u8_content_key(data: bytes) -> bytes:
+    """m3u8 正文的指纹：只取分片 URI 行（# 注释行与空行不参与）。"""
+    seg_lines = b"\n".join(
+        l for l in data.splitlines() if l and not l.startswith(b"#")
+    )
+    return hashlib.blake2b(seg_lines, digest_size=16).digest()
+
+
+def parse_m3u8_segments(text: str, base_url: str) -> list:
+    """提取媒体 m3u8 的分片 URI（跳过 # 注释行），相对地址按 base_url 解析。"""
+    segs = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        segs.append(urljoin(base_url, line))
+    return segs
+
+
+def download_hls_parallel(url: str, data: bytes, mp4_path: str, m3u8_path: str = ""):
+    """
+    并行下载 HLS：N 线程拉 TS 分片（复用连接池），ffmpeg concat 合并。
+    master playlist（分片仍是 m3u8）或无法解析时回退到 ffmpeg。
+    """
+    text = data.decode("utf-8", "ignore")
+    raw_uris = [l.strip() for l in text.splitlines()
+                if l.strip() and not l.startswith("#")]
+    segs = parse_m3u8_segments(text, url)
+
+    # 加密流（EXT-X-KEY）裸拼接出来是废片，fMP4（EXT-X-MAP）会丢 init 段，
+    # 这两种清单都交给 ffmpeg 处理
+    if (not segs or any(".m3u8" in s for s in segs)
+            or "#EXT-X-KEY" in text or "#EXT-X-MAP" in text):
+        # 清单里全是绝对地址时直接喂已落盘的本地文件，省一次清单往返；
+        # 有相对地址则只能回退 URL（本地文件无法解析相对分片）
+        if m3u8_path and raw_uris and all(
+                u.startswith(("http://", "https://")) for u in raw_uris):
+            cmd = ["ffmpeg", "-y",
+                   "-protocol_whitelist", "file,http,https,tcp,tls",
+                   "-i", m3u8_path, "-c", "copy", mp4_path]
+        else:
+            cmd = ["ffmpeg", "-y", "-i", url, "-c", "copy", mp4_path]
+        try:
+            subprocess.Popen(cmd)
+            print(f"[FFMPEG HLS] start download → {mp4_path}")
+        except Exception as e:
+            append_line(VIDEO_ERROR_LOG, f"[FFMPEG_HLS_ERROR] {e} url={url}")
+        return
+
+    def worker():
+        base = os.path.splitext(os.path.basename(mp4_path))[0]
+        seg_dir = os.path.join(TS_DIR, base)
+        os.makedirs(seg_dir, exist_ok=True)
+
+        def fetch(idx_seg):
+            idx, seg_url = idx_seg
+            seg_path = os.path.join(seg_dir, f"{idx:05d}.ts")
+            with SESSION.get(
+                    seg_url,
+                    stream=True,
+                    timeout=(10, 60),
+                    verify=verify_for_url(seg_url),
+            ) as r:
+                r.raise_for_status()
+                with open(seg_path, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=1024 * 256):
+                        if chunk:
+                            f.write(chunk)
+            return seg_path
+
+        try:
+            with ThreadPoolExecutor(max_workers=HLS_WORKERS) as pool:
+                seg_paths = list(pool.map(fetch, enumerate(segs)))
+
+            list_path = os.path.join(seg_dir, "list.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for p in seg_paths:
+                    f.write(f"file '{os.path.abspath(p)}'\n")
+
+            subprocess.run(
+                ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", mp4_path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            print(f"[HLS DONE] {mp4_path}  ({len(seg_paths)} segments)")
+        except Exception as e:
+            append_line(VIDEO_ERROR_LOG, f"[HLS_PARALLEL_ERROR] {e} url={url}")
+            print(f"[HLS ERROR] {e}")
+
+    threading.Thread(target=worker, daemon=True).start()
+    print(f"[HLS PARALLEL] {len(segs)} segments × {HLS_WORKERS} workers → {mp4_path}")
+
+
+def save_m3u8_and_download(flow: http.HTTPFlow, sp, key: str):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = flow.response.get_content(strict=False)
     status = flow.response.status_code
 
     if status not in (200, 206):
         append_line(VIDEO_ERROR_LOG, f"[NON_200_M3U8] status={status} url={url}")
         return
-    if len(data) < 10:
-        append_line(VIDEO_ERROR_LOG, f"[SMALL_M3U8] len={len(data)} url={url}")
+    if not data or len(data) < 10:
+        append_line(VIDEO_ERROR_LOG, f"[SMALL_M3U8] len={len(data) if data else 0} url={url}")
         return
 
-    k = url_key(url)
-    if k in SEEN_VIDEO_URL:
+    if not SEEN_VIDEO_URL.add(key):
         return
-    SEEN_VIDEO_URL.add(k)
 
     append_line(VIDEO_URL_LOG, url)
 
-    fname = url.split("/")[-1].split("?")[0] or "index.m3u8"
+    fname = sp.path.split("/")[-1] or "index.m3u8"
     if not fname.endswith(".m3u8"):
         fname += ".m3u8"
 
@@ -477,25 +692,25 @@ def save_m3u8_and_download(flow: http.HTTPFlow):
     save_binary(m3u8_path, data)
     print(f"[M3U8 SAVE] {m3u8_path}")
 
+    digest = _m3u8_content_key(data)
+    if digest in _SEEN_M3U8_HASHES:
+        print(f"[M3U8 DUP] 同内容流已在下载，跳过 {url[:80]}")
+        return
+    _SEEN_M3U8_HASHES.add(digest)
+
     mp4_name = fname.replace(".m3u8", ".mp4")
     mp4_path = os.path.join(MP4_DIR, mp4_name)
 
-    cmd = ["ffmpeg", "-y", "-i", url, "-c", "copy", mp4_path]
-    try:
-        subprocess.Popen(cmd)
-        print(f"[FFMPEG HLS] start download → {mp4_path}")
-    except Exception as e:
-        append_line(VIDEO_ERROR_LOG, f"[FFMPEG_HLS_ERROR] {e} url={url}")
+    download_hls_parallel(url, data, mp4_path, m3u8_path)
 
 
-def save_ts_segment(flow: http.HTTPFlow):
-    url = flow.request.pretty_url
-    data = flow.response.content or b""
-    if len(data) < 10:
+def save_ts_segment(flow: http.HTTPFlow, sp, key: str):
+    data = flow.response.get_content(strict=False)
+    if not data or len(data) < 10:
         return
 
-    fname = url.split("/")[-1].split("?")[0] or "segment.ts"
-    fname = re.sub(r'[\\/:*?"<>|]', "_", fname)
+    fname = sp.path.split("/")[-1] or "segment.ts"
+    fname = _SANITIZE_RE.sub("_", fname)
 
     save_path = os.path.join(TS_DIR, fname)
     save_binary(save_path, data)
@@ -505,26 +720,24 @@ def save_ts_segment(flow: http.HTTPFlow):
 # =======================================================
 # DASH：mpd & m4s
 # =======================================================
-def save_mpd_and_download(flow: http.HTTPFlow):
+def save_mpd_and_download(flow: http.HTTPFlow, sp, key: str):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = flow.response.get_content(strict=False)
     status = flow.response.status_code
 
     if status not in (200, 206):
         append_line(VIDEO_ERROR_LOG, f"[NON_200_MPD] status={status} url={url}")
         return
-    if len(data) < 10:
-        append_line(VIDEO_ERROR_LOG, f"[SMALL_MPD] len={len(data)} url={url}")
+    if not data or len(data) < 10:
+        append_line(VIDEO_ERROR_LOG, f"[SMALL_MPD] len={len(data) if data else 0} url={url}")
         return
 
-    k = url_key(url)
-    if k in SEEN_VIDEO_URL:
+    if not SEEN_VIDEO_URL.add(key):
         return
-    SEEN_VIDEO_URL.add(k)
 
     append_line(VIDEO_URL_LOG, url)
 
-    fname = url.split("/")[-1].split("?")[0] or "manifest.mpd"
+    fname = sp.path.split("/")[-1] or "manifest.mpd"
     if not fname.endswith(".mpd"):
         fname += ".mpd"
 
@@ -543,14 +756,13 @@ def save_mpd_and_download(flow: http.HTTPFlow):
         append_line(VIDEO_ERROR_LOG, f"[FFMPEG_DASH_ERROR] {e} url={url}")
 
 
-def save_m4s_segment(flow: http.HTTPFlow):
-    url = flow.request.pretty_url
-    data = flow.response.content or b""
-    if len(data) < 10:
+def save_m4s_segment(flow: http.HTTPFlow, sp, key: str):
+    data = flow.response.get_content(strict=False)
+    if not data or len(data) < 10:
         return
 
-    fname = url.split("/")[-1].split("?")[0] or "segment.m4s"
-    fname = re.sub(r'[\\/:*?"<>|]', "_", fname)
+    fname = sp.path.split("/")[-1] or "segment.m4s"
+    fname = _SANITIZE_RE.sub("_", fname)
     save_path = os.path.join(M4S_DIR, fname)
     save_binary(save_path, data)
     print(f"[M4S SAVE] {save_path} (len={len(data)})")
@@ -559,12 +771,11 @@ def save_m4s_segment(flow: http.HTTPFlow):
 # =======================================================
 # ★ MP4 直链：requests 流式下载（新增，模式A证书）
 # =======================================================
-def is_mp4_candidate(flow: http.HTTPFlow) -> bool:
-    url = flow.request.pretty_url.lower()
-    ct = (flow.response.headers.get("Content-Type", "") or "").lower()
+def is_mp4_candidate(url: str, ct: str) -> bool:
+    """url / ct 均为调用方已 lower() 过的字符串。"""
     if ct.startswith("video/mp4"):
         return True
-    if url.endswith(".mp4") or ".mp4?" in url:
+    if _MP4_URL_RE.search(url):
         return True
     return False
 
@@ -583,6 +794,12 @@ def pick_download_headers(flow: http.HTTPFlow) -> dict:
     return out
 
 
+# 自适应读块边界：64 KiB ~ 4 MiB，初始 256 KiB
+_CHUNK_MIN = 64 * 1024
+_CHUNK_INIT = 256 * 1024
+_CHUNK_MAX = 4 * 1024 * 1024
+
+
 def stream_download_mp4(url: str, headers: dict, out_path: str, timeout=(10, 60), max_retries=3):
     """
     requests 流式下载，支持断点续传（若 .part 已存在则续传）
@@ -603,7 +820,7 @@ def stream_download_mp4(url: str, headers: dict, out_path: str, timeout=(10, 60)
             verify_arg = verify_for_url(url)
             print(f"[MP4 DL] attempt={attempt} existing={existing} verify={verify_arg} url={url[:80]}")
 
-            with requests.get(
+            with SESSION.get(
                     url,
                     headers=req_headers,
                     stream=True,
@@ -640,14 +857,38 @@ def stream_download_mp4(url: str, headers: dict, out_path: str, timeout=(10, 60)
                 downloaded = existing
                 last_log = time.time()
 
-                with open(tmp_path, mode) as f:
-                    for chunk in r.iter_content(chunk_size=1024 * 256):
-                        if not chunk:
-                            continue
-                        f.write(chunk)
-                        downloaded += len(chunk)
+                # readinto + 预分配缓冲：每块不再新建 bytes 对象，buffering=0 去掉用户态二次缓冲
+                r.raw.decode_content = True
+                buf = bytearray(_CHUNK_MAX)
+                mv = memoryview(buf)
+
+                # 按吞吐 EWMA 自适应块大小：快链路放大到 4 MiB，慢链路缩回 64 KiB
+                chunk = _CHUNK_INIT
+                ewma = None
+                iters = 0
+                t_prev = time.time()
+
+                with open(tmp_path, mode, buffering=0) as f:
+                    while True:
+                        n = r.raw.readinto(mv[:chunk])
+                        if not n:
+                            break
+                        f.write(mv[:n])
+                        downloaded += n
 
                         now = time.time()
+                        dt = now - t_prev
+                        t_prev = now
+                        if dt > 0:
+                            bw = n / dt
+                            ewma = bw if ewma is None else 0.9 * ewma + 0.1 * bw
+                        iters += 1
+                        if iters % 16 == 0 and ewma is not None:
+                            if ewma > 4 * chunk and chunk < _CHUNK_MAX:
+                                chunk *= 2
+                            elif ewma < chunk and chunk > _CHUNK_MIN:
+                                chunk //= 2
+
                         if now - last_log >= 2:
                             if total:
                                 pct = downloaded * 100 / total
@@ -656,10 +897,8 @@ def stream_download_mp4(url: str, headers: dict, out_path: str, timeout=(10, 60)
                                 print(f"[MP4 DL] {os.path.basename(out_path)}  ({downloaded} bytes)")
                             last_log = now
 
-            # 完成：原子替换
-            if os.path.exists(out_path):
-                os.remove(out_path)
-            os.rename(tmp_path, out_path)
+            # 完成：原子替换（单个系统调用，无 exists/remove 竞态窗口）
+            os.replace(tmp_path, out_path)
             print(f"[MP4 DONE] {out_path}")
             return
 
@@ -672,7 +911,7 @@ def stream_download_mp4(url: str, headers: dict, out_path: str, timeout=(10, 60)
             existing = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
 
 
-def start_mp4_download_once(flow: http.HTTPFlow):
+def start_mp4_download_once(flow: http.HTTPFlow, sp, key: str):
     """
     对同一个 mp4 URL（按路径）只触发一次后台下载，避免 Range 多次触发
     """
@@ -682,30 +921,29 @@ def start_mp4_download_once(flow: http.HTTPFlow):
 
     if status not in (200, 206):
         return
-    if not is_mp4_candidate(flow):
+    if not is_mp4_candidate(url.lower(), ct):
         return
 
-    k = url_key(url)
-    if k in SEEN_MP4_URL:
+    if not SEEN_MP4_URL.add(key):
         return
-    SEEN_MP4_URL.add(k)
 
     append_line(VIDEO_URL_LOG, url)
 
-    base = url.split("?")[0].split("/")[-1] or "video.mp4"
+    base = sp.path.split("/")[-1] or "video.mp4"
     if not base.endswith(".mp4"):
         base += ".mp4"
-    base = re.sub(r'[\\/:*?"<>|]', "_", base)
+    base = _SANITIZE_RE.sub("_", base)
 
-    h = hashlib.md5(url.encode("utf-8")).hexdigest()[:8]
+    # 仅作文件名唯一性后缀，crc32 比 MD5 上下文+hexdigest 便宜得多
+    h = f"{zlib.crc32(url.encode('utf-8')):08x}"
     out_path = os.path.join(MP4_DIRECT_DIR, f"{base[:-4]}_{h}.mp4")
 
     headers = pick_download_headers(flow)
 
     with DOWNLOADING_LOCK:
-        if k in DOWNLOADING:
+        if key in DOWNLOADING:
             return
-        DOWNLOADING.add(k)
+        DOWNLOADING.add(key)
 
     def worker():
         try:
@@ -713,70 +951,170 @@ def start_mp4_download_once(flow: http.HTTPFlow):
             stream_download_mp4(url, headers, out_path)
         finally:
             with DOWNLOADING_LOCK:
-                DOWNLOADING.discard(k)
+                DOWNLOADING.discard(key)
 
     threading.Thread(target=worker, daemon=True).start()
 
 
+# =======================================================
+# mitmproxy 回调：响应头阶段（大视频流式直通，不进内存）
+# =======================================================
+# 注意：application/octet-stream 不能按 Content-Type 直通——很多站点把图片也
+# 标成 octet-stream，直通后既不落盘也不记日志；后缀为 .mp4/.ts/.m4s 时由
+# _STREAM_URL_SUFFIXES 兜住，足以覆盖 octet-stream 的视频场景
+_STREAM_CT_PREFIXES = ("video/",)
+_STREAM_URL_SUFFIXES = (".mp4", ".ts", ".m4s")
+
+
+@lru_cache(maxsize=4096)
+def _url_parts(url: str):
+    """responseheaders / response 两个钩子对同一 flow 共享一次 URL 解析。"""
+    sp = urlsplit(url)
+    return url.lower(), sp, (sp.hostname or "").lower()
+
+
+def responseheaders(flow: http.HTTPFlow):
+    """
+    MP4/TS/M4S 这类大响应开启 mitmproxy 流式直通：
+    代理不再把整个实体缓冲进 flow.response.content，
+    真正的下载由 requests 在带外完成（见 start_mp4_download_once）。
+    """
+    ct = (flow.response.headers.get("Content-Type", "") or "").lower()
+    url_l, sp, _ = _url_parts(flow.request.pretty_url)
+    if ct.startswith(_STREAM_CT_PREFIXES) or sp.path.lower().endswith(_STREAM_URL_SUFFIXES):
+        flow.response.stream = True
+
+
 # =======================================================
 # mitmproxy 回调：响应阶段
 # =======================================================
-def response(flow: http.HTTPFlow):
+# 快速预筛：命中任一条件才进入完整的图片/视频流水线
+_INTERESTING_HOST_SUFFIXES = (
+    "plusx.cn", "qq.com", "smtcdns.com", "qpic.cn", "qlogo.cn", "photovision.cn",
+)
+_MEDIA_CT_RE = re.compile(r"image/|video/|mpegurl|dash\+xml|mp2t|octet-stream")
+_MEDIA_URL_HINT_RE = re.compile(
+    r"\.(?:jpg|jpeg|png|gif|bmp|webp|avif|heic|svg|m3u8|ts|mpd|m4s|mp4)(?:\?|$)|tplv|m3u8"
+)
+
+# ---- 运行期代码生成：把静态的白名单/正则配置偏特化成一个扁平分类函数 ----
+# 返回位掩码，response() 据此一次分发，不再逐个跑 predicate
+IMG_LOG = 1
+IMG_SAVE = 2
+VID_LOG = 4
+VID_M3U8 = 8
+VID_TS = 16
+VID_MPD = 32
+VID_M4S = 64
+VID_MP4 = 128
+
+_CLASSIFY_SRC = """
+def _classify(host, url, url_l, ct, path,
+              _white=_white, _video_exts=_video_exts,
+              _img_hint=_img_hint, _img_block=_img_block,
+              _tplv=_tplv, _image_re=_image_re):
+    k = 0
+
+    # ---- 图片 ----
+    if not _img_block(url_l) and (
+            _img_hint(url_l) or ct.startswith("image/")):
+        k |= 1    # IMG_LOG
+    if host in _white or ct.startswith("image/") or _tplv(url) or _image_re(url):
+        k |= 2    # IMG_SAVE
+
+    # ---- 视频 ----
+    ext = path.rpartition(".")[2].lower()
+    if (
+            ext in _video_exts
+            or ("m3u8" in url_l and ("api" in url_l or "/m3u8/" in url_l))
+            or ct.startswith(("application/vnd.apple.mpegurl", "application/x-mpegurl",
+                              "application/dash+xml", "video/"))
+            or ct == "video/mp2t"
+            or (".m4s" in url_l and ct.startswith(("video/", "application/octet-stream")))
+    ):
+        k |= 4    # VID_LOG
+        if ext == "mp4" or ct.startswith("video/mp4"):
+            k |= 128    # VID_MP4
+        elif ext == "m3u8" or ct.startswith(("application/vnd.apple.mpegurl",
+                                             "application/x-mpegurl")):
+            k |= 8      # VID_M3U8
+        elif ext == "ts" or ct == "video/mp2t":
+            k |= 16     # VID_TS
+        elif ext == "mpd" or ct.startswith("application/dash+xml"):
+            k |= 32     # VID_MPD
+        elif ext == "m4s" or ".m4s" in url_l:
+            k |= 64     # VID_M4S
+    return k
+"""
+
+_classify_ns = {
+    "_white": frozenset(DOMAIN_WHITELIST),
+    "_video_exts": _VIDEO_EXTS,
+    "_img_hint": _IMG_HINT_RE.search,
+    "_img_block": _IMG_BLOCK_RE.search,
+    "_tplv": TPLV_IMG_RE.search,
+    "_image_re": IMAGE_RE.match,
+}
+exec(compile(_CLASSIFY_SRC, "<media_dump codegen>", "exec"), _classify_ns)
+_classify = _classify_ns["_classify"]
+
+# 视频子类型位 → 处理函数（分类器保证这几位互斥），response() 查表 O(1) 分发
+_VID_KIND_MASK = VID_M3U8 | VID_TS | VID_MPD | VID_M4S
+_VID_HANDLERS = {
+    VID_M3U8: save_m3u8_and_download,
+    VID_TS: save_ts_segment,
+    VID_MPD: save_mpd_and_download,
+    VID_M4S: save_m4s_segment,
+}
+
+
+async def response(flow: http.HTTPFlow):
+    # 磁盘写入 / ffmpeg 启动统一丢到工作线程，不阻塞 mitmproxy 事件循环
+    # URL 解析经 _url_parts 缓存：responseheaders 已算过的这里直接命中
     url = flow.request.pretty_url
-    host = (urlparse(url).hostname or "").lower()
-    content_type = (flow.response.headers.get("Content-Type", "")).lower()
-
-    # 1) 图片：记录所有图片相关 URL
-    if is_image_candidate(flow):
-        log_all_image_url(flow)
-
-    # 保存图片
-    if host in DOMAIN_WHITELIST:
-        save_image(flow)
-    elif TPLV_IMG_RE.search(url):
-        save_image(flow)
-    elif IMAGE_RE.match(url):
-        save_image(flow)
-    elif content_type.startswith("image/"):
-        save_image(flow)
-
-    # 2) 视频：记录所有视频相关 URL（HLS + DASH + MP4）
-    if is_video_candidate(flow):
-        log_all_video_url(flow)
-
-        # MP4 直链：优先处理（公众号常见）
-        if is_mp4_candidate(flow):
-            start_mp4_download_once(flow)
-            return
+    url_l, sp, host = _url_parts(url)
+    content_type = flow.response.headers.get("Content-Type", "").lower()
 
-        # HLS：m3u8
-        if (
-                content_type.startswith("application/vnd.apple.mpegurl")
-                or content_type.startswith("application/x-mpegurl")
-                or url.endswith(".m3u8")
-                or ".m3u8?" in url
-        ):
-            save_m3u8_and_download(flow)
-            return
+    # 绝大多数 flow（JS/XHR/埋点/字体）在这里一次判断直接丢弃
+    if (
+            not host.endswith(_INTERESTING_HOST_SUFFIXES)
+            and not _MEDIA_CT_RE.search(content_type)
+            and not _MEDIA_URL_HINT_RE.search(url_l)
+    ):
+        return
 
-        # HLS：ts
-        if url.endswith(".ts") or ".ts?" in url or content_type == "video/mp2t":
-            save_ts_segment(flow)
-            return
+    k = _classify(host, url, url_l, content_type, sp.path)
+    if not k:
+        return
 
-        # DASH：mpd
-        if (
-                url.endswith(".mpd")
-                or ".mpd?" in url
-                or content_type.startswith("application/dash+xml")
-        ):
-            save_mpd_and_download(flow)
-            return
+    # 去重 key 整个 flow 只算一次，所有 handler 复用
+    key = url_key(sp)
 
-        # DASH：m4s
-        if url.endswith(".m4s") or ".m4s?" in url or ".m4s" in url:
-            save_m4s_segment(flow)
-            return
+    # 流式直通的响应没有缓冲实体：只记 URL + 触发带外 MP4 下载
+    if flow.response.stream:
+        if k & VID_LOG:
+            log_all_video_url(url, content_type, key)
+            if k & VID_MP4:
+                start_mp4_download_once(flow, sp, key)
+        return
+
+    # 1) 图片：记录所有图片相关 URL + 保存
+    if k & IMG_LOG:
+        log_all_image_url(url, content_type, key)
+    if k & IMG_SAVE:
+        await asyncio.to_thread(save_image, flow, sp, key)
+
+    # 2) 视频：记录所有视频相关 URL（HLS + DASH + MP4）+ 分类型处理
+    if k & VID_LOG:
+        log_all_video_url(url, content_type, key)
+
+        if k & VID_MP4:
+            # MP4 直链：优先处理（公众号常见）
+            start_mp4_download_once(flow, sp, key)
+        else:
+            handler = _VID_HANDLERS.get(k & _VID_KIND_MASK)
+            if handler is not None:
+                await asyncio.to_thread(handler, flow, sp, key)
 
 
 # =======================================================
@@ -803,3 +1141,17 @@ def request(flow: http.HTTPFlow):
 
     if modified:
         print(f"[ANTICACHE] Removed cache headers for: {flow.request.pretty_url[:80]}")
+
+
+# =======================================================
+# mitmproxy 回调：退出阶段（清理日志句柄）
+# =======================================================
+def done():
+    _flush_logs()
+    for f in _LOG_HANDLES.values():
+        try:
+            f.flush()
+            f.close()
+        except Exception:
+            pass
+    _LOG_HANDLES.clear()
@@ -4,78 +4,96 @@ import os
 import shlex
 import subprocess
 import requests
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 
 # ================================================================
-# 图片识别正则
+# 图片识别正则（bytes 版：扫描 zip 成员原始字节，免整文件 decode）
 # ================================================================
-IMAGE_PATTERNS = [
-    r"https?://[^\"'\s]+\.(?:jpg|jpeg|png|gif|webp|bmp|svg)(?:\?[^\"'\s]*)?",
-    r"/[^\"'\s]+\.(?:jpg|jpeg|png|gif|webp|bmp|svg)(?:\?[^\"'\s]*)?",
-]
+IMAGE_URL_RE = re.compile(
+    rb"(?:https?://|/)[^\"'\s]+?\.(?:jpg|jpeg|png|gif|webp|bmp|svg)(?:\?[^\"'\s]*)?",
+    re.IGNORECASE,
+)
+
+# 响应头行（bytes 版，状态行没有冒号自然跳过）
+HEADER_LINE_RE = re.compile(rb"([^\r\n:]+):[ \t]*([^\r\n]*)")
+
+# 共享连接池：同一 CDN 的多张图片复用 TCP/TLS 连接
+SESSION = requests.Session()
+SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64))
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64))
 
 
 # ================================================================
 # SAZ 解析：提取请求 & 响应（包含 headers）
 # ================================================================
-def parse_saz(saz_path):
-    requests_map = {}
-    responses_map = {}
+def _parse_req(rf, data):
+    """解析单个 _c.txt，返回 (会话 id, 请求信息) 或 None。"""
+    rid = rf.split("_")[0]
+    raw = data.decode("utf-8", "ignore")
+    lines = raw.splitlines()
+    if not lines:
+        return None
 
-    with zipfile.ZipFile(saz_path, "r") as z:
-        namelist = z.namelist()
+    m = re.match(r"(GET|POST|HEAD|OPTIONS)\s+(\S+)\s+HTTP", lines[0])
+    if not m:
+        return None
 
-        req_files = [f for f in namelist if f.endswith("_c.txt")]
-        resp_files = [f for f in namelist if f.endswith("_s.txt")]
+    method = m.group(1)
+    url = m.group(2)
+    headers = {}
 
-        # ------------ 解析请求(_c.txt) ------------
-        for rf in req_files:
-            rid = rf.split("_")[0]
-            raw = z.read(rf).decode("utf-8", "ignore")
-            lines = raw.splitlines()
-            if not lines:
-                continue
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip()] = v.strip()
 
-            m = re.match(r"(GET|POST|HEAD|OPTIONS)\s+(\S+)\s+HTTP", lines[0])
-            if not m:
-                continue
+    return rid, {
+        "url": url,
+        "method": method,
+        "headers": headers
+    }
 
-            method = m.group(1)
-            url = m.group(2)
-            headers = {}
 
-            for line in lines[1:]:
-                if ":" in line:
-                    k, v = line.split(":", 1)
-                    headers[k.strip()] = v.strip()
+def _parse_resp(sf, data):
+    """解析单个 _s.txt，返回 (会话 id, 响应信息)。"""
+    rid = sf.split("_")[0]
 
-            requests_map[rid] = {
-                "url": url,
-                "method": method,
-                "headers": headers
-            }
+    # 只定位一次头部结束位置并切片，body（可能好几 MB）既不复制也不 decode
+    end = data.find(b"\r\n\r\n")
+    header_block = data[:end if end >= 0 else len(data)]
 
-        # ------------ 解析响应(_s.txt) ------------
-        for sf in resp_files:
-            rid = sf.split("_")[0]
-            raw = z.read(sf).decode("utf-8", "ignore")
+    headers = {}
+    for m in HEADER_LINE_RE.finditer(header_block):
+        headers[m.group(1).decode("latin1", "ignore").strip()] = \
+            m.group(2).decode("latin1", "ignore").strip()
 
-            header_block = raw.split("\r\n\r\n")[0]
-            header_lines = header_block.splitlines()[1:]
+    content_type = headers.get("Content-Type", "").lower()
 
-            headers = {}
-            for line in header_lines:
-                if ":" in line:
-                    k, v = line.split(":", 1)
-                    headers[k.strip()] = v.strip()
+    return rid, {
+        "headers": headers,
+        "content_type": content_type
+    }
 
-            content_type = headers.get("Content-Type", "").lower()
 
-            responses_map[rid] = {
-                "headers": headers,
-                "content_type": content_type
-            }
+def parse_saz(saz_path):
+    with zipfile.ZipFile(saz_path, "r") as z:
+        namelist = z.namelist()
+
+        req_files = [f for f in namelist if f.endswith("_c.txt")]
+        resp_files = [f for f in namelist if f.endswith("_s.txt")]
+
+        # ZipFile 并发 read 不安全，先串行读出字节，再并行解析
+        data = {n: z.read(n) for n in req_files + resp_files}
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        req_results = ex.map(_parse_req, req_files, (data[f] for f in req_files))
+        resp_results = ex.map(_parse_resp, resp_files, (data[f] for f in resp_files))
+
+        requests_map = dict(r for r in req_results if r is not None)
+        responses_map = dict(resp_results)
 
     return requests_map, responses_map
 
@@ -104,17 +122,17 @@ def extract_image_urls(saz_path):
 
     with zipfile.ZipFile(saz_path, "r") as z:
         for name in z.namelist():
-            if not (name.endswith(".txt") or name.endswith(".xml")):
+            if not name.endswith((".txt", ".xml")):
                 continue
 
             try:
-                raw = z.read(name).decode("utf-8", "ignore")
+                raw = z.read(name)
             except:
                 continue
 
-            for pat in IMAGE_PATTERNS:
-                for u in re.findall(pat, raw, flags=re.IGNORECASE):
-                    urls.add(u)
+            # 一次 bytes 扫描，只 decode 命中的 URL 本身
+            for m in IMAGE_URL_RE.finditer(raw):
+                urls.add(m.group(0).decode("utf-8", "ignore"))
 
     return list(urls)
 
@@ -145,7 +163,7 @@ def download_image(url, headers, save_dir):
     print(f"🖼  图片下载: {url}")
 
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = SESSION.get(url, headers=headers, timeout=10)
         if resp.status_code == 200:
             with open(save_path, "wb") as f:
                 f.write(resp.content)
@@ -229,15 +247,17 @@ def extract_from_saz(saz_path, output_dir="./output"):
     image_save_dir = os.path.join(output_dir, "images")
     os.makedirs(image_save_dir, exist_ok=True)
 
+    # 请求 URL 排序一次，之后每张图片用二分找最长前缀，免双重循环
+    sorted_reqs = sorted(requests_map.values(), key=lambda r: r["url"])
+    sorted_urls = [r["url"] for r in sorted_reqs]
+
     for img_url in img_urls:
-        # 找图片属于哪个请求（需要匹配 header）
+        # 找图片属于哪个请求（需要匹配 header）：精确匹配或前缀匹配
         matched_header = None
 
-        for rid, req in requests_map.items():
-            # 精确匹配或前缀匹配
-            if req["url"] == img_url or img_url.startswith(req["url"]):
-                matched_header = req["headers"]
-                break
+        i = bisect_right(sorted_urls, img_url) - 1
+        if i >= 0 and img_url.startswith(sorted_urls[i]):
+            matched_header = sorted_reqs[i]["headers"]
 
         if not matched_header:
             continue
@@ -6,6 +6,10 @@ import subprocess
 from urllib.parse import urlparse
 
 
+# 响应头行（bytes 版，状态行没有冒号自然跳过）
+HEADER_LINE_RE = re.compile(rb"([^\r\n:]+):[ \t]*([^\r\n]*)")
+
+
 def parse_saz(saz_path):
     """
     解析 SAZ 文件，提取请求与响应（按 session ID 匹配）
@@ -58,17 +62,16 @@ def parse_saz(saz_path):
         for sf in resp_files:
             rid = sf.split("_")[0]
 
-            raw = z.read(sf).decode("utf-8", "ignore")
+            raw = z.read(sf)
 
-            # 提取响应头（第一段）
-            header_block = raw.split("\r\n\r\n")[0]
-            header_lines = header_block.splitlines()[1:]
+            # 提取响应头（第一段），body 不 decode 也不复制
+            end = raw.find(b"\r\n\r\n")
+            header_block = raw[:end if end >= 0 else len(raw)]
 
             headers = {}
-            for line in header_lines:
-                if ":" in line:
-                    k, v = line.split(":", 1)
-                    headers[k.strip()] = v.strip()
+            for m in HEADER_LINE_RE.finditer(header_block):
+                headers[m.group(1).decode("latin1", "ignore").strip()] = \
+                    m.group(2).decode("latin1", "ignore").strip()
 
             content_type = headers.get("Content-Type", "").lower()
 
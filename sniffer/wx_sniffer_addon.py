@@ -5,8 +5,15 @@
 
 import os
 import re
+import sys
+import atexit
+import queue
 import hashlib
+import threading
 import subprocess
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import urlparse
 from datetime import datetime
@@ -63,30 +70,308 @@ except Exception:
     print(f"[WX-SNIFFER] loaded. WORKDIR={WORKDIR} OUTPUT={BASE_DIR}")
 
 # =======================================================
-# 去重集合
+# 预编译正则：每个 flow 都会走到，别让 re 每次去查模式缓存
 # =======================================================
-SEEN_IMAGE_URL = set()
-SEEN_IMAGE_ALL_URL = set()
-SEEN_VIDEO_URL = set()
-SEEN_VIDEO_ALL_URL = set()
+# 图片扩展名 + 关键词（tplv / 微信 / 头像 / 自有域名）合一条 alternation，URL 只扫一遍
+_IMG_HINT_RE = re.compile(
+    r"\.(?:jpg|jpeg|png|gif|bmp|webp|avif|heic|svg)(?:\?|$)"
+    r"|tplv|mmbiz|qlogo\.cn|pb\.plusx\.cn",
+    re.IGNORECASE,
+)
+_URL_EXT_RE = re.compile(r"\.(jpg|jpeg|png|gif|bmp|webp|svg|avif|heic)(\?|$)", re.IGNORECASE)
+# 视频同理：一条命名组正则直接给出类型，免去逐类型 endswith/in 扫描
+_VIDEO_KIND_RE = re.compile(r"\.(?P<kind>m3u8|ts|mpd|m4s)(?:[?#]|$)", re.IGNORECASE)
+# URL 没带后缀时按 Content-Type 兜底映射类型
+_VIDEO_CT_KINDS = (
+    ("application/vnd.apple.mpegurl", "m3u8"),
+    ("application/x-mpegurl", "m3u8"),
+    ("application/dash+xml", "mpd"),
+    ("video/mp2t", "ts"),
+)
+_SAFE_NAME_RE = re.compile(r'[\\/:*?"<>|]')
+_ORIG_NAME_RE = re.compile(r"(DSC|IMGS|IMG|PXL|photo|mmexport)[A-Za-z0-9_-]+\.", re.IGNORECASE)
+_ALNUM_RE = re.compile(r"[A-Za-z0-9_-]{3,}")
+_TPLV_SPLIT_RE = re.compile(r"[\*~]tplv")
+
+# 可选：装了 python-hyperscan 时把上面这组 URL 模式编成一个 DFA，
+# 每个 flow 只扫一遍 URL 就拿到全部命中；装不上就继续走 re
+_HS_VIDEO_IDS = {1: "m3u8", 2: "ts", 3: "mpd", 4: "m4s"}
+_HS_IMG_IDS = frozenset((5, 6))
+try:
+    import hyperscan
+    _HS_DB = hyperscan.Database()
+    _HS_DB.compile(
+        expressions=[
+            rb"\.m3u8([?#]|$)",
+            rb"\.ts([?#]|$)",
+            rb"\.mpd([?#]|$)",
+            rb"\.m4s([?#]|$)",
+            rb"\.(jpg|jpeg|png|gif|bmp|webp|avif|heic|svg)(\?|$)",
+            rb"tplv|mmbiz|qlogo\.cn|pb\.plusx\.cn",
+        ],
+        ids=[1, 2, 3, 4, 5, 6],
+        flags=[hyperscan.HS_FLAG_CASELESS] * 6,
+    )
+except Exception:
+    _HS_DB = None
+
+
+@lru_cache(maxsize=4096)
+def _hs_match_ids(url: str):
+    """hyperscan 扫一遍 URL，返回命中的模式 id 集合；不可用时返回 None。"""
+    if _HS_DB is None:
+        return None
+    ids = set()
+
+    def on_match(mid, start, end, flags, context):
+        ids.add(mid)
+        return 0  # 继续收集其余命中
+
+    try:
+        _HS_DB.scan(url.encode("utf-8", "ignore"), match_event_handler=on_match)
+    except Exception:
+        return None
+    return ids
+
+
+# =======================================================
+# 去重集合：固定容量 LRU，长时间抓包不会无限涨内存
+# =======================================================
+class LRUSet:
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.d = OrderedDict()
+
+    def __contains__(self, k):
+        return k in self.d
+
+    def add(self, k) -> bool:
+        """首见返回 True；重复返回 False（并刷新热度）。一次哈希探测完成查+插。"""
+        if k in self.d:
+            self.d.move_to_end(k)
+            return False
+        self.d[k] = None
+        if len(self.d) > self.cap:
+            self.d.popitem(last=False)
+        return True
 
 
+# 可选：装了 pybloom_live 时在 LRU 前面挂一层 Bloom，首见 URL（绝大多数）
+# 一次位测试即可判负，不用碰 OrderedDict
+try:
+    from pybloom_live import ScalableBloomFilter
+    _HAS_BLOOM = True
+except ImportError:
+    _HAS_BLOOM = False
+
+
+class BloomLRUSet(LRUSet):
+    def __init__(self, cap: int):
+        super().__init__(cap)
+        self.bloom = ScalableBloomFilter(initial_capacity=10_000, error_rate=1e-4)
+
+    def add(self, k) -> bool:
+        """Bloom 判负是精确的，直接收下；疑似重复才查精确集合。"""
+        if k not in self.bloom:
+            self.bloom.add(k)
+            super().add(k)
+            return True
+        return super().add(k)
+
+
+SEEN_CAP = 100_000
+_SeenSet = BloomLRUSet if _HAS_BLOOM else LRUSet
+
+SEEN_IMAGE_URL = _SeenSet(SEEN_CAP)
+SEEN_IMAGE_ALL_URL = _SeenSet(SEEN_CAP)
+SEEN_VIDEO_URL = _SeenSet(SEEN_CAP)
+SEEN_VIDEO_ALL_URL = _SeenSet(SEEN_CAP)
+
+
+@lru_cache(maxsize=8192)
 def url_key(url: str) -> str:
+    # 同一 URL 在图片/视频分支里会被重复求 key，缓存住省掉重复 split
     return url.split("?", 1)[0]
 
 
+# 已确认存在的目录：省掉每次写文件的 stat+mkdir 系统调用
+_ENSURED_DIRS = set()
+
+# 磁盘写入线程池：response() 回调不再阻塞在 write() 上
+_IO_POOL = ThreadPoolExecutor(max_workers=8)
+
+
+def _write_bytes(path: Path, content: bytes):
+    d = str(path.parent)
+    if d not in _ENSURED_DIRS:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ENSURED_DIRS.add(d)
+    # 单次落盘直接走 os.open/os.write，省掉 BufferedWriter/FileIO 的构造开销
+    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(content)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+        if hasattr(os, "posix_fadvise"):
+            # 写完即忘的素材，不让它占着页缓存
+            os.posix_fadvise(fd, 0, len(content), os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _log_write_failure(path: Path):
+    """线程池里的写盘异常不会自动冒出来，挂个回调把它打出来。"""
+    def _done(fut):
+        exc = fut.exception()
+        if exc is not None:
+            print(f"[WRITE ERROR] {path}: {exc}")
+    return _done
+
+
+# 可选：Linux 上装了 liburing 时批量走 io_uring，一次 submit 替代一批 write 系统调用
+try:
+    import liburing
+    _HAS_URING = sys.platform.startswith("linux")
+except ImportError:
+    _HAS_URING = False
+
+
+class UringWriter:
+    """攒一批写请求 → 每个挂一个 SQE → 一次 io_uring_submit → 统一收割 CQE。"""
+
+    MAX_BATCH = 64
+
+    def __init__(self, depth: int = 256):
+        self.ring = liburing.io_uring()
+        liburing.io_uring_queue_init(depth, self.ring, 0)
+        self.q = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, path: Path, content: bytes):
+        self.q.put((path, content))
+
+    def _worker(self):
+        while True:
+            batch = [self.q.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self.q.get_nowait())
+                except queue.Empty:
+                    break
+
+            fds = []
+            try:
+                for path, content in batch:
+                    d = str(path.parent)
+                    if d not in _ENSURED_DIRS:
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        _ENSURED_DIRS.add(d)
+                    fd = os.open(str(path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                    fds.append(fd)
+                    sqe = liburing.io_uring_get_sqe(self.ring)
+                    liburing.io_uring_prep_write(sqe, fd, content, len(content), 0)
+
+                liburing.io_uring_submit(self.ring)
+
+                cqe = liburing.io_uring_cqe()
+                for _ in fds:
+                    liburing.io_uring_wait_cqe(self.ring, cqe)
+                    liburing.io_uring_cqe_seen(self.ring, cqe)
+            except Exception as e:
+                print(f"[URING ERROR] {e}，本批回退线程池写入")
+                for path, content in batch:
+                    fut = _IO_POOL.submit(_write_bytes, path, content)
+                    fut.add_done_callback(_log_write_failure(path))
+            finally:
+                for fd in fds:
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
+
+
+_URING_WRITER = UringWriter() if _HAS_URING else None
+
+
 def save_binary(path: Path, content: bytes):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "wb") as f:
-        f.write(content)
+    if _URING_WRITER is not None:
+        _URING_WRITER.submit(path, content)
+    else:
+        fut = _IO_POOL.submit(_write_bytes, path, content)
+        fut.add_done_callback(_log_write_failure(path))
+
+
+# 日志：生产者只往内存缓冲里 append，后台线程批量 writelines 到常驻句柄
+_LOG_FLUSH_INTERVAL = 0.5
+_LOG_MAX_BATCH = 256
+_LOG_HANDLES = {}
+_LOG_BUF = defaultdict(list)
+_LOG_BUF_LOCK = threading.Lock()
+_LOG_WAKE = threading.Event()
+
+
+def _get_log(path: Path):
+    f = _LOG_HANDLES.get(path)
+    if f is None:
+        f = open(path, "a", encoding="utf-8", buffering=1 << 16)
+        _LOG_HANDLES[path] = f
+    return f
 
 
 def append_line(path: Path, line: str):
-    try:
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(line.rstrip("\n") + "\n")
-    except Exception as e:
-        print(f"[LOG ERROR] {path}: {e}")
+    with _LOG_BUF_LOCK:
+        buf = _LOG_BUF[path]
+        buf.append(line.rstrip("\n") + "\n")
+        backlog = len(buf)
+    if backlog >= _LOG_MAX_BATCH:
+        _LOG_WAKE.set()
+
+
+def _flush_logs():
+    with _LOG_BUF_LOCK:
+        batches = [(p, lines[:]) for p, lines in _LOG_BUF.items() if lines]
+        for p, _ in batches:
+            _LOG_BUF[p].clear()
+
+    for p, lines in batches:
+        try:
+            f = _get_log(p)
+            f.writelines(lines)
+            f.flush()
+        except Exception as e:
+            print(f"[LOG ERROR] {p}: {e}")
+
+
+def _log_flusher():
+    while True:
+        _LOG_WAKE.wait(_LOG_FLUSH_INTERVAL)
+        _LOG_WAKE.clear()
+        _flush_logs()
+
+
+def _close_logs():
+    """落盘残余缓冲并关闭常驻句柄（done() 和 atexit 共用）。"""
+    _flush_logs()
+    for f in _LOG_HANDLES.values():
+        try:
+            f.close()
+        except Exception:
+            pass
+    _LOG_HANDLES.clear()
+
+
+threading.Thread(target=_log_flusher, daemon=True).start()
+# mitmdump 非正常退出（done() 没跑到）时兜底落盘
+atexit.register(_close_logs)
+
+
+def response_body(flow: http.HTTPFlow) -> bytes:
+    """取响应体。没有 Content-Encoding 时 raw_content 就是最终数据，省一次整包解码复制。"""
+    ce = flow.response.headers.get("Content-Encoding", "").lower()
+    if ce in ("", "identity"):
+        return flow.response.raw_content or b""
+    return flow.response.content or b""
 
 
 # =======================================================
@@ -95,7 +380,7 @@ def append_line(path: Path, line: str):
 def log_unparsed_image(flow: http.HTTPFlow, reason: str, extra: str = ""):
     url = flow.request.pretty_url
     headers = flow.response.headers
-    data = flow.response.content or b""
+    data = response_body(flow)
     length = len(data)
 
     ct = headers.get("Content-Type", "")
@@ -127,27 +412,22 @@ def log_unparsed_image(flow: http.HTTPFlow, reason: str, extra: str = ""):
 # 图片候选 / 全量日志
 # =======================================================
 def is_image_candidate(flow: http.HTTPFlow) -> bool:
-    url = flow.request.pretty_url.lower()
-    ct = flow.response.headers.get("Content-Type", "").lower()
+    url = flow.request.pretty_url
     if "hm.baidu.com/hm.gif" in url:
         return False
-    if re.search(r"\.(jpg|jpeg|png|gif|bmp|webp|avif|heic|svg)(\?|$)", url):
-        return True
-    if "tplv" in url:
-        return True
-    if ct.startswith("image/"):
-        return True
-    if any(x in url for x in ["mmbiz", "qlogo.cn", "mmbiz.qpic.cn", "pb.plusx.cn"]):
-        return True
-    return False
+    ids = _hs_match_ids(url)
+    if ids is not None:
+        url_hit = bool(ids & _HS_IMG_IDS)
+    else:
+        url_hit = _IMG_HINT_RE.search(url) is not None
+    ct = flow.response.headers.get("Content-Type", "").lower()
+    return url_hit or ct.startswith("image/")
 
 
 def log_all_image_url(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    key = url_key(url)
-    if key in SEEN_IMAGE_ALL_URL:
+    if not SEEN_IMAGE_ALL_URL.add(url_key(url)):
         return
-    SEEN_IMAGE_ALL_URL.add(key)
     ct = flow.response.headers.get("Content-Type", "").lower()
     append_line(IMAGE_ALL_LOG, f"{url}    [ct={ct}]")
 
@@ -155,38 +435,40 @@ def log_all_image_url(flow: http.HTTPFlow):
 # =======================================================
 # 视频候选 / 全量日志（HLS + DASH）
 # =======================================================
-def is_video_candidate(flow: http.HTTPFlow) -> bool:
-    url = flow.request.pretty_url.lower()
+def classify_video(flow: http.HTTPFlow):
+    """一次分类返回视频类型（"m3u8"/"ts"/"mpd"/"m4s"），非视频返回 None。
+
+    其它 video/* 响应（如 mp4 直连）返回 "video"：只进全量日志，没有独立处理器。
+    """
+    url = flow.request.pretty_url
+    ids = _hs_match_ids(url)
+    if ids is not None:
+        for i, kind in _HS_VIDEO_IDS.items():
+            if i in ids:
+                return kind
+    else:
+        m = _VIDEO_KIND_RE.search(url)
+        if m:
+            return m.group("kind").lower()
+
     ct = flow.response.headers.get("Content-Type", "").lower()
-    if url.endswith(".m3u8") or ".m3u8?" in url:
-        return True
-    if "m3u8" in url and ("api" in url or "/m3u8/" in url):
-        return True
-    if ct.startswith("application/vnd.apple.mpegurl") or ct.startswith("application/x-mpegurl"):
-        return True
-    if url.endswith(".ts") or ".ts?" in url:
-        return True
-    if ct == "video/mp2t":
-        return True
-    if url.endswith(".mpd") or ".mpd?" in url:
-        return True
-    if ct.startswith("application/dash+xml"):
-        return True
-    if url.endswith(".m4s") or ".m4s?" in url:
-        return True
-    if ".m4s" in url and (ct.startswith("video/") or ct.startswith("application/octet-stream")):
-        return True
+    for prefix, kind in _VIDEO_CT_KINDS:
+        if ct.startswith(prefix):
+            return kind
     if ct.startswith("video/"):
-        return True
-    return False
+        return "video"
+
+    # 少数站点把 m3u8 藏在 api 路径/参数里
+    url_l = url.lower()
+    if "/m3u8/" in url_l or ("m3u8" in url_l and "api" in url_l):
+        return "m3u8"
+    return None
 
 
 def log_all_video_url(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    key = url_key(url)
-    if key in SEEN_VIDEO_ALL_URL:
+    if not SEEN_VIDEO_ALL_URL.add(url_key(url)):
         return
-    SEEN_VIDEO_ALL_URL.add(key)
     ct = flow.response.headers.get("Content-Type", "").lower()
     append_line(VIDEO_ALL_LOG, f"{url}    [ct={ct}]")
 
@@ -194,17 +476,22 @@ def log_all_video_url(flow: http.HTTPFlow):
 # =======================================================
 # 图片格式识别 / 文件名推断
 # =======================================================
+# 文件头前缀表 + ftyp 品牌表：一次遍历/一次字典查替代逐条 if 链
+_HEAD_PREFIXES = (
+    (b"\xFF\xD8\xFF", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+_FTYP_BRANDS = {b"ftypavif": "avif", b"ftypheic": "heic", b"ftypheif": "heic"}
+
+
 def detect_magic_ext(data: bytes) -> str:
-    if data.startswith(b"\xFF\xD8\xFF"):
-        return "jpg"
-    if data.startswith(b"\x89PNG\r\n\x1a\n"):
-        return "png"
-    if data.startswith(b"GIF87a") or data.startswith(b"GIF89a"):
-        return "gif"
-    if len(data) >= 12 and data[4:12] == b"ftypavif":
-        return "avif"
-    if len(data) >= 12 and data[4:12] in (b"ftypheic", b"ftypheif"):
-        return "heic"
+    for prefix, ext in _HEAD_PREFIXES:
+        if data.startswith(prefix):
+            return ext
+    if len(data) >= 12:
+        return _FTYP_BRANDS.get(data[4:12])
     return None
 
 
@@ -231,7 +518,7 @@ def ext_from_imagex_fmt(fmt: str) -> str:
 
 
 def ext_from_url(url: str):
-    m = re.search(r"\.(jpg|jpeg|png|gif|bmp|webp|svg|avif|heic)(\?|$)", url, re.IGNORECASE)
+    m = _URL_EXT_RE.search(url)
     if m:
         return m.group(1).lower()
     return None
@@ -260,28 +547,32 @@ def detect_image_ext(flow: http.HTTPFlow, data: bytes) -> str:
 
 
 def extract_original_name(url: str) -> str:
-    clean = url.split("?")[0]
+    clean, _, _ = url.partition("?")
     parts = clean.split("/")
 
     for p in parts:
-        if re.match(r"(DSC|IMGS|IMG|PXL|photo|mmexport)[A-Za-z0-9_-]+\.", p, re.IGNORECASE):
+        if _ORIG_NAME_RE.match(p):
             return p.split(".")[0]
 
     if len(parts) > 2:
         cand = parts[-2]
-        if re.match(r"[A-Za-z0-9_-]{3,}", cand) and "tplv" not in cand:
+        if _ALNUM_RE.match(cand) and "tplv" not in cand:
             return cand
 
-    last = re.split(r"[\*~]tplv", parts[-1])[0]
+    last = _TPLV_SPLIT_RE.split(parts[-1])[0]
     last = last.split(".")[0]
-    if re.match(r"[A-Za-z0-9_-]{3,}", last):
+    if _ALNUM_RE.match(last):
         return last
 
-    h = hashlib.md5(clean.encode()).hexdigest()[:10]
+    h = hashlib.blake2b(clean.encode(), digest_size=5).hexdigest()
     return f"img_{h}"
 
 
-def detect_animated_avif(path: str) -> bool:
+# AVIF 探测 + 转换都要起子进程，丢到后台线程池，不卡 mitmproxy 回调
+_MEDIA_POOL = ThreadPoolExecutor(max_workers=4)
+
+
+def _detect_animated_avif_ffprobe(path: str) -> bool:
     try:
         result = subprocess.run(
             ["ffprobe", "-v", "error", "-show_entries", "stream=nb_frames",
@@ -294,6 +585,22 @@ def detect_animated_avif(path: str) -> bool:
         return False
 
 
+def detect_animated_avif(path: str) -> bool:
+    """
+    动画 AVIF（图片序列）的 ftyp 品牌里带 'avis'，读文件头就能判断，
+    不用为每张小图起一个 ffprobe 进程；解析不了再回退 ffprobe。
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+        size = int.from_bytes(head[:4], "big")
+        if head[4:8] != b"ftyp" or size < 16:
+            return False
+        return b"avis" in head[8:min(size, len(head))]
+    except Exception:
+        return _detect_animated_avif_ffprobe(path)
+
+
 def convert_avif(path: str, name_root: str, animated: bool):
     if animated:
         gif_path = IMG_CONVERT_DIR / f"{name_root}.gif"
@@ -311,9 +618,14 @@ def convert_avif(path: str, name_root: str, animated: bool):
         print(f"[AVIF→JPG] {out}")
 
 
+def _avif_pipeline(path: str, name_root: str):
+    animated = detect_animated_avif(path)
+    convert_avif(path, name_root, animated)
+
+
 def save_image(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = response_body(flow)
 
     status = flow.response.status_code
     if status not in (200, 206):
@@ -323,11 +635,9 @@ def save_image(flow: http.HTTPFlow):
         log_unparsed_image(flow, "EMPTY_OR_TOO_SMALL")
         return
 
-    k = url_key(url)
-    if k in SEEN_IMAGE_URL:
+    if not SEEN_IMAGE_URL.add(url_key(url)):
         log_unparsed_image(flow, "DUPLICATE_URL")
         return
-    SEEN_IMAGE_URL.add(k)
 
     append_line(IMAGE_URL_LOG, url)
 
@@ -337,20 +647,49 @@ def save_image(flow: http.HTTPFlow):
         log_unparsed_image(flow, "UNKNOWN_FORMAT_BIN")
         return
 
-    final_name = re.sub(r'[\\/:*?"<>|]', "_", f"{name_root}.{ext}")
+    final_name = _SAFE_NAME_RE.sub("_", f"{name_root}.{ext}")
     save_path = IMG_DIR / final_name
     save_binary(save_path, data)
     print(f"[IMG SAVE] {save_path}  (fmt={ext}, len={len(data)})")
 
     if ext == "avif":
-        animated = detect_animated_avif(str(save_path))
-        convert_avif(str(save_path), name_root, animated)
+        _MEDIA_POOL.submit(_avif_pipeline, str(save_path), name_root)
 
 
 # ---------------- HLS / DASH ----------------
+# 并发 ffmpeg 限流：视频多的页面会瞬间触发一堆清单，放任起进程反而拖慢整体
+_FFMPEG_SEM = threading.BoundedSemaphore(max(1, (os.cpu_count() or 2) // 2))
+_FFMPEG_PENDING = queue.Queue()
+
+
+def _ffmpeg_launcher():
+    """后台串行拿名额、起进程；名额由守护线程等进程退出后归还。"""
+    while True:
+        cmd, url = _FFMPEG_PENDING.get()
+        _FFMPEG_SEM.acquire()
+        try:
+            p = subprocess.Popen(cmd)
+        except Exception as e:
+            _FFMPEG_SEM.release()
+            append_line(VIDEO_ERROR_LOG, f"[FFMPEG_SPAWN_ERROR] {e} url={url}")
+            continue
+        threading.Thread(target=lambda p=p: (p.wait(), _FFMPEG_SEM.release()),
+                         daemon=True).start()
+
+
+threading.Thread(target=_ffmpeg_launcher, daemon=True).start()
+
+
+def _run_ffmpeg_bounded(cmd, url):
+    """只入队不等名额：名额满时在 response() 钩子里阻塞 acquire 会把
+    mitmproxy 的事件循环整个卡住（ffmpeg 一跑就是几分钟），所以真正的
+    acquire + Popen 全部挪到 launcher 线程里做。"""
+    _FFMPEG_PENDING.put((cmd, url))
+
+
 def save_m3u8_and_download(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = response_body(flow)
     status = flow.response.status_code
 
     if status not in (200, 206):
@@ -360,14 +699,12 @@ def save_m3u8_and_download(flow: http.HTTPFlow):
         append_line(VIDEO_ERROR_LOG, f"[SMALL_M3U8] len={len(data)} url={url}")
         return
 
-    k = url_key(url)
-    if k in SEEN_VIDEO_URL:
+    if not SEEN_VIDEO_URL.add(url_key(url)):
         return
-    SEEN_VIDEO_URL.add(k)
 
     append_line(VIDEO_URL_LOG, url)
 
-    fname = url.split("/")[-1].split("?")[0] or "index.m3u8"
+    fname = url.rpartition("/")[2].partition("?")[0] or "index.m3u8"
     if not fname.endswith(".m3u8"):
         fname += ".m3u8"
 
@@ -378,21 +715,27 @@ def save_m3u8_and_download(flow: http.HTTPFlow):
     mp4_name = fname.replace(".m3u8", ".mp4")
     mp4_path = MP4_DIR / mp4_name
 
-    cmd = ["ffmpeg", "-y", "-i", url, "-c", "copy", str(mp4_path)]
-    try:
-        subprocess.Popen(cmd)
-        print(f"[FFMPEG HLS] start download → {mp4_path}")
-    except Exception as e:
-        append_line(VIDEO_ERROR_LOG, f"[FFMPEG_HLS_ERROR] {e} url={url}")
+    # 分片全是绝对地址时直接喂刚落盘的本地清单，省掉 ffmpeg 重新拉一次清单；
+    # 含相对地址只能回退 URL（本地文件没法解析相对分片）
+    uris = [l.strip() for l in data.decode("utf-8", "ignore").splitlines()
+            if l.strip() and not l.startswith("#")]
+    if uris and all(u.startswith(("http://", "https://")) for u in uris):
+        src = ["-protocol_whitelist", "file,http,https,tcp,tls", "-i", str(m3u8_path)]
+    else:
+        src = ["-i", url]
+
+    cmd = ["ffmpeg", "-y", "-threads", "1", *src, "-c", "copy", str(mp4_path)]
+    _run_ffmpeg_bounded(cmd, url)
+    print(f"[FFMPEG HLS] queue download → {mp4_path}")
 
 
 def save_ts_segment(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = response_body(flow)
     if len(data) < 10:
         return
-    fname = url.split("/")[-1].split("?")[0] or "segment.ts"
-    fname = re.sub(r'[\\/:*?"<>|]', "_", fname)
+    fname = url.rpartition("/")[2].partition("?")[0] or "segment.ts"
+    fname = _SAFE_NAME_RE.sub("_", fname)
     save_path = TS_DIR / fname
     save_binary(save_path, data)
     print(f"[TS SAVE] {save_path} (len={len(data)})")
@@ -400,7 +743,7 @@ def save_ts_segment(flow: http.HTTPFlow):
 
 def save_mpd_and_download(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = response_body(flow)
     status = flow.response.status_code
 
     if status not in (200, 206):
@@ -410,14 +753,12 @@ def save_mpd_and_download(flow: http.HTTPFlow):
         append_line(VIDEO_ERROR_LOG, f"[SMALL_MPD] len={len(data)} url={url}")
         return
 
-    k = url_key(url)
-    if k in SEEN_VIDEO_URL:
+    if not SEEN_VIDEO_URL.add(url_key(url)):
         return
-    SEEN_VIDEO_URL.add(k)
 
     append_line(VIDEO_URL_LOG, url)
 
-    fname = url.split("/")[-1].split("?")[0] or "manifest.mpd"
+    fname = url.rpartition("/")[2].partition("?")[0] or "manifest.mpd"
     if not fname.endswith(".mpd"):
         fname += ".mpd"
 
@@ -428,26 +769,31 @@ def save_mpd_and_download(flow: http.HTTPFlow):
     mp4_name = fname.replace(".mpd", ".mp4")
     mp4_path = MP4_DIR / mp4_name
 
-    cmd = ["ffmpeg", "-y", "-i", url, "-c", "copy", str(mp4_path)]
-    try:
-        subprocess.Popen(cmd)
-        print(f"[FFMPEG DASH] start download → {mp4_path}")
-    except Exception as e:
-        append_line(VIDEO_ERROR_LOG, f"[FFMPEG_DASH_ERROR] {e} url={url}")
+    cmd = ["ffmpeg", "-y", "-threads", "1", "-i", url, "-c", "copy", str(mp4_path)]
+    _run_ffmpeg_bounded(cmd, url)
+    print(f"[FFMPEG DASH] queue download → {mp4_path}")
 
 
 def save_m4s_segment(flow: http.HTTPFlow):
     url = flow.request.pretty_url
-    data = flow.response.content or b""
+    data = response_body(flow)
     if len(data) < 10:
         return
-    fname = url.split("/")[-1].split("?")[0] or "segment.m4s"
-    fname = re.sub(r'[\\/:*?"<>|]', "_", fname)
+    fname = url.rpartition("/")[2].partition("?")[0] or "segment.m4s"
+    fname = _SAFE_NAME_RE.sub("_", fname)
     save_path = M4S_DIR / fname
     save_binary(save_path, data)
     print(f"[M4S SAVE] {save_path} (len={len(data)})")
 
 
+# 类型 -> 处理器：response() 里一次查表替代四段 if 链
+VIDEO_HANDLERS = {
+    "m3u8": save_m3u8_and_download,
+    "ts": save_ts_segment,
+    "mpd": save_mpd_and_download,
+    "m4s": save_m4s_segment,
+}
+
 TPLV_IMG_RE = re.compile(r".*[\*~]tplv", re.IGNORECASE)
 IMAGE_RE = re.compile(r".*\.(jpg|jpeg|png|gif|bmp|webp|avif|heic)(\?.*)?$", re.IGNORECASE)
 DOMAIN_WHITELIST = {"pb.plusx.cn", "plusx.cn", "live.photovision.cn"}
@@ -465,33 +811,21 @@ def response(flow: http.HTTPFlow):
     if host in DOMAIN_WHITELIST or TPLV_IMG_RE.search(url) or IMAGE_RE.match(url) or content_type.startswith("image/"):
         save_image(flow)
 
-    # 视频：全量记录 + 分类型处理
-    if is_video_candidate(flow):
+    # 视频：分类一次，全量记录 + 查表分发
+    kind = classify_video(flow)
+    if kind:
         log_all_video_url(flow)
-
-        if (
-                content_type.startswith("application/vnd.apple.mpegurl")
-                or content_type.startswith("application/x-mpegurl")
-                or url.endswith(".m3u8")
-                or ".m3u8?" in url
-        ):
-            save_m3u8_and_download(flow)
-            return
-
-        if url.endswith(".ts") or ".ts?" in url or content_type == "video/mp2t":
-            save_ts_segment(flow)
-            return
-
-        if url.endswith(".mpd") or ".mpd?" in url or content_type.startswith("application/dash+xml"):
-            save_mpd_and_download(flow)
-            return
-
-        if url.endswith(".m4s") or ".m4s?" in url or ".m4s" in url:
-            save_m4s_segment(flow)
-            return
+        handler = VIDEO_HANDLERS.get(kind)
+        if handler is not None:
+            handler(flow)
 
 
 def request(flow: http.HTTPFlow):
     remove_headers = ["If-Modified-Since", "If-None-Match", "If-Range", "Cache-Control", "Pragma"]
     for h in remove_headers:
         flow.request.headers.pop(h, None)
+
+
+def done():
+    # mitmdump 退出前把缓冲里的日志落盘
+    _close_logs()
@@ -1,13 +1,15 @@
 import os
 import sys
+import time
 import traceback
+import selectors
 import socket
 import subprocess
 import re
 from pathlib import Path
 from typing import Optional
 
-from PySide6.QtCore import QThread, Signal, Slot
+from PySide6.QtCore import QThread, QTimer, Signal, Slot
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QTextEdit, QLabel, QLineEdit, QFileDialog, QMessageBox
@@ -16,6 +18,9 @@ from PySide6.QtWidgets import (
 APP_TITLE = "微信媒体嗅探 GUI（内置 PythonRuntime + mitmdump）"
 DEFAULT_PORT = 8080  # 仅用于占用检测提示，真正监听端口由 mitmproxy 决定
 
+# netstat 输出里的 LISTENING 行（预编译，findstr 循环里不再重复编译）
+_LISTENING_RE = re.compile(r"\sLISTENING\s+(\d+)\s*$", re.IGNORECASE)
+
 
 # ------------------ 路径与环境工具 ------------------ #
 
@@ -62,20 +67,32 @@ def resource_path(rel_path: str) -> Path:
     return base / rel_path
 
 
+# 双击启动按钮等场景 1 秒内会重复探测同一端口，缓存住免得反复建 socket
+_PORT_CACHE = {}
+_PORT_CACHE_TTL = 1.0
+
+
 def port_is_free(host: str, port: int) -> bool:
     """检测端口是否空闲，仅用于提示（不强制）。"""
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((host, port))
-        return True
-    except OSError:
-        return False
-    finally:
+    now = time.monotonic()
+    cached = _PORT_CACHE.get((host, port))
+    if cached is not None and now - cached[1] < _PORT_CACHE_TTL:
+        return cached[0]
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        if sys.platform.startswith("win"):
+            # Windows 上 SO_REUSEADDR 会让已占用端口也 bind 成功，独占模式才准
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            s.close()
-        except Exception:
-            pass
+            s.bind((host, port))
+            free = True
+        except OSError:
+            free = False
+
+    _PORT_CACHE[(host, port)] = (free, now)
+    return free
 
 
 def find_listening_pid_windows(port: int) -> Optional[int]:
@@ -89,10 +106,9 @@ def find_listening_pid_windows(port: int) -> Optional[int]:
         return None
 
     for line in out.splitlines():
-        if "LISTENING" in line.upper():
-            m = re.search(r"\sLISTENING\s+(\d+)\s*$", line, re.IGNORECASE)
-            if m:
-                return int(m.group(1))
+        m = _LISTENING_RE.search(line)
+        if m:
+            return int(m.group(1))
     return None
 
 
@@ -124,6 +140,55 @@ class MitmProcessRunner(QThread):
             except Exception as e:
                 self.log.emit(f"[WARN] 停止进程失败: {e}")
 
+    def _emit_lines(self, raw: bytes):
+        """按块解码 + 多行合并成一次 emit，减少跨线程信号量。"""
+        text = raw.decode("utf-8", "replace").rstrip("\n")
+        if text.strip():
+            self.log.emit(text)
+
+    def _drain_stdout(self):
+        """
+        按 64KB 块读 mitmdump 输出并整块切行：
+        - POSIX：非阻塞 fd + selector，空转时顺带探测进程退出
+        - Windows：select 不支持管道，退回阻塞式块读（仍然整块切行）
+        """
+        stdout = self._proc.stdout
+        residual = bytearray()
+
+        if not sys.platform.startswith("win"):
+            os.set_blocking(stdout.fileno(), False)
+            sel = selectors.DefaultSelector()
+            sel.register(stdout, selectors.EVENT_READ)
+            try:
+                while True:
+                    if not sel.select(timeout=0.2):
+                        if self._proc.poll() is not None:
+                            break
+                        continue
+                    chunk = stdout.read(65536)
+                    if not chunk:
+                        break
+                    residual += chunk
+                    *lines, rest = residual.split(b"\n")
+                    residual = bytearray(rest)
+                    if lines:
+                        self._emit_lines(b"\n".join(lines))
+            finally:
+                sel.close()
+        else:
+            while True:
+                chunk = stdout.read(65536)
+                if not chunk:
+                    break
+                residual += chunk
+                *lines, rest = residual.split(b"\n")
+                residual = bytearray(rest)
+                if lines:
+                    self._emit_lines(b"\n".join(lines))
+
+        if residual:
+            self._emit_lines(bytes(residual))
+
     def run(self):
         try:
             os.makedirs(self.workdir, exist_ok=True)
@@ -155,17 +220,12 @@ class MitmProcessRunner(QThread):
                 env=env,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
+                bufsize=0,
                 creationflags=creationflags,
             )
 
             assert self._proc.stdout is not None
-            for line in self._proc.stdout:
-                line = line.rstrip("\n")
-                if line:
-                    self.log.emit(line)
+            self._drain_stdout()
 
             ret = self._proc.wait()
             self._proc = None
@@ -253,10 +313,25 @@ class MitmGui(QWidget):
         layout.addWidget(QLabel("实时日志（包含 mitmdump 输出）："))
         self.log_box = QTextEdit()
         self.log_box.setReadOnly(True)
+        # 限制保留行数，日志风暴时不会把内存越撑越大
+        self.log_box.document().setMaximumBlockCount(5000)
         layout.addWidget(self.log_box)
 
+        # 日志先进内存缓冲，定时器 20Hz 批量刷进 QTextEdit：
+        # mitmdump 刷屏时一次 append + 重绘替代逐行 N 次
+        self._log_buf = []
+        self._log_timer = QTimer(self)
+        self._log_timer.setInterval(50)
+        self._log_timer.timeout.connect(self._flush_log)
+        self._log_timer.start()
+
     def append_log(self, s: str):
-        self.log_box.append(s.rstrip("\n"))
+        self._log_buf.append(s.rstrip("\n"))
+
+    def _flush_log(self):
+        if self._log_buf:
+            self.log_box.append("\n".join(self._log_buf))
+            self._log_buf.clear()
 
     @Slot()
     def pick_workdir(self):
@@ -0,0 +1,38 @@
+"""GUI 共用的端口 / 路径工具。
+
+uvd_server_gui 原来把这几个函数和 sniffer GUI 各复制了一份，抽出来统一维护。
+全部带完整类型注解，方便以后接 mypyc / Cython 之类的编译器提速。
+"""
+
+import re
+import subprocess
+from pathlib import Path
+from typing import Optional
+
+# netstat 输出里的 LISTENING 行（预编译，findstr 循环里不再重复编译）
+_LISTENING_RE = re.compile(r"\sLISTENING\s+(\d+)\s*$", re.IGNORECASE)
+
+
+def default_workdir(app_name: str) -> Path:
+    """默认工作目录：文档目录（不存在则用户主目录）下的 app_name 子目录。"""
+    home = Path.home()
+    docs = home / "Documents"
+    base = docs if docs.exists() else home
+    return base / app_name
+
+
+def find_listening_pid_windows(port: int) -> Optional[int]:
+    """在 Windows 下查找占用端口的 PID，用于友好提示"""
+    try:
+        out = subprocess.check_output(
+            ["cmd", "/c", f"netstat -ano | findstr :{port}"],
+            text=True, encoding="utf-8", errors="ignore"
+        )
+    except Exception:
+        return None
+
+    for line in out.splitlines():
+        m = _LISTENING_RE.search(line)
+        if m:
+            return int(m.group(1))
+    return None
@@ -1,27 +1,41 @@
 import os
+import re
 import sys
+import json
+import atexit
+import logging
+import logging.handlers
+import queue
+import socket
+import sqlite3
 import threading
+import time
 import uuid
 import shutil
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
-from PySide6.QtCore import QThread, Signal, Slot
+from PySide6.QtCore import QThread, QTimer, QUrl, Signal, Slot
+from PySide6.QtGui import QDesktopServices
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QTextEdit, QLabel, QLineEdit, QFileDialog, QMessageBox
 )
 
-import socket
-import subprocess
-import re
+from _platform import default_workdir as _default_workdir
+from _platform import find_listening_pid_windows
 
 APP_TITLE = "Universal Video Downloader Server GUI"
 DEFAULT_PORT = 18888
+# 应用层重试上限（yt-dlp 内部已有自己的 retries，这里只兜整次任务失败）
+MAX_DOWNLOAD_TRIES = 2
 EXT_ORIGIN = "chrome-extension://cmmeiigobejkpakmfbnmopgcbohgdaol"
 
 
@@ -30,44 +44,133 @@ EXT_ORIGIN = "chrome-extension://cmmeiigobejkpakmfbnmopgcbohgdaol"
 # ======================
 
 def default_workdir() -> Path:
-    home = Path.home()
-    docs = home / "Documents"
-    base = docs if docs.exists() else home
-    return base / "uvd-server"
+    return _default_workdir("uvd-server")
 
 
-def port_is_free(host: str, port: int) -> bool:
-    """检测端口是否空闲，仅用于提示"""
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((host, port))
-        return True
-    except OSError:
-        return False
-    finally:
-        try:
-            s.close()
-        except Exception:
-            pass
-
-
-def find_listening_pid_windows(port: int):
-    """在 Windows 下查找占用端口的 PID，用于友好提示"""
-    try:
-        out = subprocess.check_output(
-            ["cmd", "/c", f"netstat -ano | findstr :{port}"],
-            text=True, encoding="utf-8", errors="ignore"
-        )
-    except Exception:
-        return None
+# URL 平台识别：一条 alternation 扫一遍 URL，替代逐平台 in 子串扫描
+_PLATFORM_RE = re.compile(
+    r"(youtube|youtu\.be|bilibili|douyin|tiktok|instagram|twitter|x\.com)",
+    re.IGNORECASE,
+)
+_PLATFORM_MAP = {
+    "youtube": "youtube",
+    "youtu.be": "youtube",
+    "bilibili": "bilibili",
+    "douyin": "douyin",
+    "tiktok": "tiktok",
+    "instagram": "instagram",
+    "twitter": "twitter",
+    "x.com": "twitter",
+}
+
+
+@lru_cache(maxsize=1024)
+def detect_platform(url: str) -> str:
+    m = _PLATFORM_RE.search(url)
+    return _PLATFORM_MAP[m.group(1).lower()] if m else "generic"
+
+
+class TaskStore:
+    """有界任务表：容量满了按 LRU 淘汰，终态（finished/error）条目按 TTL 回收。
+
+    之前的裸 dict 只进不出，服务端长跑内存随任务数线性涨。
+    给了 db_path 时公开字段写穿到 SQLite（WAL）：重启后旧任务仍可查询，
+    队列/Future 这类进程内状态只留在内存。
+    """
 
-    for line in out.splitlines():
-        if "LISTENING" in line.upper():
-            m = re.search(r"\sLISTENING\s+(\d+)\s*$", line, re.IGNORECASE)
-            if m:
-                return int(m.group(1))
-    return None
+    MAX_TASKS = 10_000
+    TERMINAL_TTL = 3600.0  # 终态任务保留 1 小时供查询
+
+    _DB_FIELDS = ("task_id", "url", "mode", "platform", "status", "progress", "error")
+
+    def __init__(self, db_path=None):
+        self._lock = threading.Lock()
+        self._d: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(
+                str(db_path), check_same_thread=False, isolation_level=None
+            )
+            self._db_lock = threading.Lock()
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY, url TEXT, mode TEXT, platform TEXT,"
+                " status TEXT, progress INTEGER, error TEXT, ts REAL)"
+            )
+
+    def __setitem__(self, tid: str, task: Dict[str, Any]):
+        with self._lock:
+            self._d[tid] = task
+            self._d.move_to_end(tid)
+            while len(self._d) > self.MAX_TASKS:
+                self._d.popitem(last=False)
+
+    def __getitem__(self, tid: str) -> Dict[str, Any]:
+        return self._d[tid]
+
+    def __contains__(self, tid: str) -> bool:
+        return tid in self._d
+
+    def get(self, tid: str, default=None):
+        return self._d.get(tid, default)
+
+    def mark_terminal(self, tid: str):
+        t = self._d.get(tid)
+        if t is not None:
+            t["_terminal_at"] = time.monotonic()
+
+    def persist(self, tid: str):
+        """UPSERT 任务的公开字段（WAL 下一次写亚毫秒级），没配库时是空操作。"""
+        if self._db is None:
+            return
+        t = self._d.get(tid)
+        if t is None:
+            return
+        row = tuple(t.get(k) for k in self._DB_FIELDS) + (time.time(),)
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO tasks (task_id, url, mode, platform, status, progress, error, ts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(task_id) DO UPDATE SET"
+                " status=excluded.status, progress=excluded.progress,"
+                " error=excluded.error, ts=excluded.ts",
+                row,
+            )
+
+    def load_persisted(self, tid: str):
+        """内存里没有时回落查库：服务重启后历史任务仍可查询。"""
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT task_id, url, mode, platform, status, progress, error"
+                " FROM tasks WHERE task_id=?",
+                (tid,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {k: v for k, v in zip(self._DB_FIELDS, row) if v is not None}
+
+    def run_eviction(self, now: float = None):
+        """清掉超过 TTL 的终态任务（独立成方法，定时线程和测试都能直接调）。"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            dead = [
+                tid for tid, t in self._d.items()
+                if t.get("_terminal_at") is not None
+                and now - t["_terminal_at"] > self.TERMINAL_TTL
+            ]
+            for tid in dead:
+                del self._d[tid]
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "DELETE FROM tasks WHERE status IN ('finished', 'error') AND ts < ?",
+                    (time.time() - self.TERMINAL_TTL,),
+                )
 
 
 # ======================
@@ -81,16 +184,15 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
     gui_log_emit：可选的日志回调，用于在 GUI 中输出日志
     """
     app = Flask(__name__)
-    CORS(app, resources={r"/*": {"origins": EXT_ORIGIN}}, supports_credentials=True)
-
-    # 让跨域头固定返回给 Chrome 插件
-    @app.after_request
-    def after_request(response):
-        response.headers["Access-Control-Allow-Origin"] = EXT_ORIGIN
-        response.headers["Access-Control-Allow-Methods"] = "GET,POST,OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type"
-        response.headers["Access-Control-Allow-Credentials"] = "true"
-        return response
+    # 跨域全部交给 flask-cors：它在扩展层一次配置好插件来源、凭据和预检，
+    # 不用再挂一个每个响应都跑一遍的 after_request 手工设头（还会重复设置）
+    CORS(
+        app,
+        resources={r"/*": {"origins": EXT_ORIGIN}},
+        supports_credentials=True,
+        allow_headers=["Content-Type"],
+        methods=["GET", "POST", "OPTIONS"],
+    )
 
     # 路径配置：用 base_dir 替代原来的 __file__ 所在目录
     base_dir = Path(base_dir).resolve()
@@ -100,14 +202,70 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
     download_dir = base_dir / "downloads"
     download_dir.mkdir(parents=True, exist_ok=True)
 
-    # 任务字典
-    tasks: Dict[str, Dict[str, Any]] = {}
+    # node 路径进程生命周期内不会变，启动时扫一次 PATH，
+    # 不必每个任务都 shutil.which 一轮 stat
+    node_path = shutil.which("node") or shutil.which("node.exe")
+
+    # 后台预热 yt_dlp（注册几百个 extractor 要数百毫秒）：
+    # 首个任务来时模块已在 sys.modules 里，函数内的 import 变成字典查找
+    threading.Thread(
+        target=lambda: __import__("yt_dlp"), daemon=True, name="ytdlp-preimport"
+    ).start()
+
+    # 任务表（下划线开头的键是内部状态，不随 JSON 返回；公开字段落 SQLite）
+    tasks = TaskStore(db_path=base_dir / "tasks.db")
+
+    def _task_sweeper():
+        while True:
+            time.sleep(60)
+            tasks.run_eviction()
+
+    threading.Thread(target=_task_sweeper, daemon=True, name="task-evict").start()
+
+    # 下载线程池：并发度固定可控，不再每个任务裸起一个线程
+    executor = ThreadPoolExecutor(
+        max_workers=int(os.environ.get("UVD_WORKERS", 4)),
+        thread_name_prefix="uvd-dl",
+    )
+    app.extensions["uvd_executor"] = executor
+
+    # 日志统一走 logging + 队列：热路径（进度钩子、请求处理器）只做一次
+    # 入队，真正写 GUI/stdout 的 I/O 由 QueueListener 的后台线程承担
+    class _CallbackHandler(logging.Handler):
+        def emit(self, record):
+            try:
+                gui_log_emit(self.format(record))
+            except Exception:
+                pass
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("uvd")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    for h in list(logger.handlers):  # 停止后重启服务会再进一次 create_app
+        logger.removeHandler(h)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    sink = _CallbackHandler() if gui_log_emit else logging.StreamHandler(sys.stdout)
+    listener = logging.handlers.QueueListener(log_queue, sink)
+    listener.start()
+    app.extensions["uvd_log_listener"] = listener
 
     def log(msg: str):
-        if gui_log_emit:
-            gui_log_emit(msg)
-        else:
-            print(msg)
+        logger.info(msg)
+
+    def task_view(t: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in t.items() if not k.startswith("_")}
+
+    def push_task_event(task_id):
+        """把任务当前快照推给 SSE 订阅者，并落一笔库"""
+        t = tasks.get(task_id)
+        if t is None:
+            return
+        q = t.get("_queue")
+        if q is not None:
+            q.put_nowait(task_view(t))
+        tasks.persist(task_id)
 
     # 1. 更新 Cookie
     @app.post("/update_cookie")
@@ -121,25 +279,31 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
         with open(cookie_file, "w", encoding="utf-8") as f:
             f.write(cookies)
 
+        # 缓存的 YoutubeDL 在构造时就加载了 cookiejar（文件不存在时更是
+        # 永远钉在 cookiefile=None），必须整体作废，下个任务用新 cookie 重建
+        with _ydl_cache_lock:
+            stale = list(_ydl_cache.values())
+            _ydl_cache.clear()
+        for entry in stale:
+            # 正在下载的实例让它拿旧 cookie 跑完，空闲的直接关掉
+            if entry["lock"].acquire(blocking=False):
+                try:
+                    entry["ydl"].close()
+                except Exception:
+                    pass
+                finally:
+                    entry["lock"].release()
+
         log(f"[COOKIE] cookie 已更新，长度={len(cookies)}")
         return {"status": "ok", "message": "cookie 已更新"}
 
-    # 2. URL 平台识别
-    def detect_platform(url: str):
-        u = url.lower()
-        if "youtube" in u or "youtu.be" in u:
-            return "youtube"
-        if "bilibili" in u:
-            return "bilibili"
-        if "douyin" in u:
-            return "douyin"
-        if "tiktok" in u:
-            return "tiktok"
-        if "instagram" in u:
-            return "instagram"
-        if "twitter" in u or "x.com" in u:
-            return "twitter"
-        return "generic"
+    def _maybe_aria2c(opts):
+        """UVD_ARIA2C=1 且装了 aria2c 时用外部下载器：按主机复用连接 + 分段并行。
+
+        默认不开：外部下载器拿不到逐块进度，SSE 里的百分比会停在粗粒度状态。
+        """
+        if os.environ.get("UVD_ARIA2C") == "1" and shutil.which("aria2c"):
+            opts["external_downloader"] = "aria2c"
 
     # 3. 视频下载参数
     def build_video_opts(platform, task_id, node_path):
@@ -156,7 +320,14 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
             "subtitleslangs": ["auto", "zh-Hans"],
             "retries": 20,
             "extractor_retries": 10,
+            # 复用到 CDN 的 TCP 连接：字幕/封面这类小文件省一次握手 RTT
+            "http_headers": {"Connection": "keep-alive"},
+            # HLS/DASH 分片并行拉取，高延迟链路才能吃满带宽
+            "concurrent_fragment_downloads": int(os.environ.get("UVD_FRAG_CONC", "8")),
+            # 非分片格式用 Range 分块，单个大 GET 失败不用整个重来
+            "http_chunk_size": 10 * 1024 * 1024,
         }
+        _maybe_aria2c(opts)
 
         # YouTube 需要 nsig 解密
         if platform == "youtube":
@@ -173,7 +344,7 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
         elif platform == "bilibili":
             opts.update({
                 "format": "bestvideo+bestaudio/best",
-                "http_headers": {"Referer": "https://www.bilibili.com"}
+                "http_headers": {**opts["http_headers"], "Referer": "https://www.bilibili.com"}
             })
 
         elif platform in ["douyin", "tiktok"]:
@@ -193,7 +364,7 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
         audio_dir = download_dir / "audio"
         audio_dir.mkdir(parents=True, exist_ok=True)
 
-        return {
+        opts = {
             "format": "bestaudio/best",
             "outtmpl": f"{audio_dir}/%(title)s-%(id)s.%(ext)s",
             "progress_hooks": [lambda d: progress_hook(task_id, d)],
@@ -205,41 +376,101 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
             }],
             "retries": 20,
             "extractor_retries": 10,
+            "http_headers": {"Connection": "keep-alive"},
         }
+        _maybe_aria2c(opts)
+        return opts
 
-    # 5. 进度回调
+    # 5. 进度回调（yt-dlp 每个网络分片都调一次，限流到每任务最多 100ms 一次；
+    # 客户端反正渲染不了更快，中间值直接丢掉）
     def progress_hook(task_id, d):
-        if d.get("status") == "downloading":
-            tasks[task_id]["progress"] = d.get("_percent_str", "0%")
-        elif d.get("status") == "finished":
-            tasks[task_id]["progress"] = "100%"
+        status = d.get("status")
+        if status == "finished":
+            # 终态不限流，保证客户端一定能看到 100
+            tasks[task_id]["progress"] = 100
+        elif status == "downloading":
+            t = tasks[task_id]
+            now = time.monotonic()
+            if now - t.get("_last_hook", 0.0) < 0.1:
+                return
+            t["_last_hook"] = now
+            # 存整数百分比：yt-dlp 给的 "  3.4%" 这类小字符串每块都新分配一个
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            if total:
+                pct = int(d.get("downloaded_bytes", 0) * 100 // total)
+            else:
+                try:
+                    pct = int(float(d.get("_percent_str", "0").strip().rstrip("%")))
+                except ValueError:
+                    pct = 0
+            t["progress"] = pct
+        else:
+            return
+        push_task_event(task_id)
 
     # 6. 下载线程
-    def download_worker(task_id, url, mode):
+    # 同 (mode, platform) 的任务复用同一个 YoutubeDL 实例：省掉每个任务
+    # 重建 extractor 注册表 / cookiejar / HTTP 连接（TCP+TLS 握手）的开销
+    _ydl_cache: Dict[tuple, Dict[str, Any]] = {}
+    _ydl_cache_lock = threading.Lock()
+
+    def _get_ydl(mode, platform, node_path):
         import yt_dlp
 
-        platform = detect_platform(url)
-        tasks[task_id]["status"] = f"downloading-{mode}"
+        key = (mode, platform)
+        with _ydl_cache_lock:
+            entry = _ydl_cache.get(key)
+            if entry is None:
+                state = {"task_id": None}
+                if mode == "audio":
+                    opts = build_audio_opts(None)
+                else:
+                    opts = build_video_opts(platform, None, node_path)
+                # 进度钩子从 state 取当前任务 id，实例才能跨任务复用
+                opts["progress_hooks"] = [lambda d: progress_hook(state["task_id"], d)]
+                entry = {
+                    "ydl": yt_dlp.YoutubeDL(opts),
+                    # YoutubeDL 实例内部不是线程安全的，同实例的下载串行
+                    "lock": threading.Lock(),
+                    "state": state,
+                }
+                _ydl_cache[key] = entry
+        return entry
 
-        node_path = shutil.which("node") or shutil.which("node.exe")
+    atexit.register(lambda: [e["ydl"].close() for e in _ydl_cache.values()])
 
-        if mode == "audio":
-            ydl_opts = build_audio_opts(task_id)
-        else:
-            ydl_opts = build_video_opts(platform, task_id, node_path)
+    def download_worker(task_id, url, mode, platform, try_count=0):
+        tasks[task_id]["status"] = f"downloading-{mode}"
+        push_task_event(task_id)
+
+        entry = _get_ydl(mode, platform, node_path)
 
         log(f"[TASK] {task_id} 开始下载：{url} mode={mode} platform={platform}")
 
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
+            with entry["lock"]:
+                entry["state"]["task_id"] = task_id
+                entry["ydl"].download([url])
 
             tasks[task_id]["status"] = "finished"
+            tasks.mark_terminal(task_id)
+            push_task_event(task_id)
             log(f"[TASK] {task_id} 下载完成")
 
         except Exception as e:
+            if try_count + 1 < MAX_DOWNLOAD_TRIES:
+                tasks[task_id]["status"] = "retrying"
+                tasks[task_id]["try_count"] = try_count + 1
+                push_task_event(task_id)
+                log(f"[TASK] {task_id} 下载失败，重试 {try_count + 1}/{MAX_DOWNLOAD_TRIES - 1}：{e}")
+                tasks[task_id]["_future"] = executor.submit(
+                    download_worker, task_id, url, mode, platform, try_count + 1
+                )
+                return
             tasks[task_id]["status"] = "error"
             tasks[task_id]["error"] = str(e)
+            tasks.mark_terminal(task_id)
+            push_task_event(task_id)
             log(f"[TASK] {task_id} 下载失败：{e}")
 
     # 7. 创建任务
@@ -253,26 +484,64 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
             return jsonify({"status": "error", "message": "url 不能为空"}), 400
 
         task_id = str(uuid.uuid4())
+        platform = detect_platform(url)
         tasks[task_id] = {
             "task_id": task_id,
             "url": url,
             "mode": mode,
-            "platform": detect_platform(url),
+            "platform": platform,
             "status": "queued",
-            "progress": "0%"
+            "progress": 0,
+            "_queue": queue.Queue(),
         }
 
-        t = threading.Thread(target=download_worker, args=(task_id, url, mode), daemon=True)
-        t.start()
+        tasks.persist(task_id)
+        tasks[task_id]["_future"] = executor.submit(download_worker, task_id, url, mode, platform)
 
-        return jsonify(tasks[task_id])
+        return jsonify(task_view(tasks[task_id]))
 
-    # 8. 查询任务
+    # 8. 查询任务（内存没有时回落查库，重启前的任务也能查到终态）
     @app.get("/task/<task_id>")
     def get_task(task_id):
-        if task_id not in tasks:
+        t = tasks.get(task_id)
+        if t is not None:
+            return jsonify(task_view(t))
+        persisted = tasks.load_persisted(task_id)
+        if persisted is not None:
+            return jsonify(persisted)
+        return jsonify({"error": "task not found"}), 404
+
+    # 9. SSE 进度推送：插件订阅一次即可，不用反复轮询 /task/<id>
+    @app.get("/task/<task_id>/stream")
+    def stream_task(task_id):
+        t = tasks.get(task_id)
+        if t is None:
             return jsonify({"error": "task not found"}), 404
-        return jsonify(tasks[task_id])
+        q = t["_queue"]
+
+        def gen():
+            # 连上先推一帧当前状态
+            yield f"data: {json.dumps(task_view(t), ensure_ascii=False)}\n\n"
+            if t.get("status") in ("finished", "error"):
+                yield "event: done\ndata: {}\n\n"
+                return
+            while True:
+                try:
+                    msg = q.get(timeout=15)
+                except queue.Empty:
+                    # 心跳注释行，防止中间层掐掉空闲连接
+                    yield ":heartbeat\n\n"
+                    continue
+                yield f"data: {json.dumps(msg, ensure_ascii=False)}\n\n"
+                if msg.get("status") in ("finished", "error"):
+                    yield "event: done\ndata: {}\n\n"
+                    return
+
+        return Response(
+            gen(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
     log(f"[SERVER] Flask app 初始化完成，base_dir={base_dir}")
     return app
@@ -283,7 +552,6 @@ def create_app(base_dir: Path, gui_log_emit=None) -> Flask:
 # ======================
 
 class FlaskServerThread(QThread):
-    log = Signal(str)
     stopped = Signal(int)  # 0=正常停止，1=异常
 
     def __init__(self, base_dir: Path, host: str, port: int):
@@ -292,51 +560,105 @@ class FlaskServerThread(QThread):
         self.host = host
         self.port = port
         self._server = None
-        self._ctx = None
+        self._app = None
+        self._is_waitress = False
+        # 日志不再逐条跨线程发信号：先攒在这里，GUI 定时整批取走
+        self._log_buf = []
+        self._log_lock = threading.Lock()
 
     def _emit_log(self, msg: str):
-        self.log.emit(msg)
+        with self._log_lock:
+            self._log_buf.append(msg.rstrip("\n"))
+
+    def take_log_batch(self) -> str:
+        """GUI 主线程定时调用：一次取走积累的全部日志行。"""
+        with self._log_lock:
+            if not self._log_buf:
+                return ""
+            batch = "\n".join(self._log_buf)
+            self._log_buf.clear()
+        return batch
 
     def run(self):
         try:
             # 创建 Flask app
             app = create_app(self.base_dir, gui_log_emit=self._emit_log)
-
-            from werkzeug.serving import make_server
-            self._server = make_server(self.host, self.port, app)
-            self._ctx = app.app_context()
-            self._ctx.push()
-
-            self.log.emit("========================================")
-            self.log.emit(f"[SERVER] Flask 启动中：http://{self.host}:{self.port}")
-            self.log.emit(f"[SERVER] 工作目录: {self.base_dir}")
-            self.log.emit("========================================")
-
-            # 阻塞式循环，直到 shutdown() 被调用
-            self._server.serve_forever()
+            self._app = app
+
+            # 先自己绑好监听 socket 再交给服务器：检查和占用一步完成，
+            # 消除"先探测端口再启动"之间被别的进程抢走的竞态
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            if sys.platform.startswith("win"):
+                # Windows 上 SO_REUSEADDR 会抢占别的进程已占用的端口，用独占模式
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+            else:
+                # POSIX 上不开 REUSEADDR 的话，停止→启动会卡在 TIME_WAIT 报端口占用
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, self.port))
+            sock.listen(128)
+
+            # 优先 waitress：线程池 worker + keep-alive，插件的轮询/SSE
+            # 复用一条 TCP 连接；装不上再退回 werkzeug 开发服务器
+            try:
+                from waitress import create_server
+                self._server = create_server(
+                    app,
+                    sockets=[sock],
+                    threads=8,
+                    connection_limit=200,
+                    channel_timeout=120,
+                )
+                self._is_waitress = True
+            except ImportError:
+                from werkzeug.serving import make_server
+                self._server = make_server(
+                    self.host, self.port, app, threaded=True, fd=sock.fileno()
+                )
+                self._is_waitress = False
+
+            server_kind = "waitress" if self._is_waitress else "werkzeug"
+            self._emit_log("========================================")
+            self._emit_log(f"[SERVER] Flask 启动中（{server_kind}）：http://{self.host}:{self.port}")
+            self._emit_log(f"[SERVER] 工作目录: {self.base_dir}")
+            self._emit_log("========================================")
+
+            # 阻塞式循环，直到 stop() 被调用
+            if self._is_waitress:
+                self._server.run()
+            else:
+                self._server.serve_forever()
             self.stopped.emit(0)
 
         except OSError as e:
-            self.log.emit(f"[ERROR] 端口 {self.port} 可能被占用：{e}")
+            pid = find_listening_pid_windows(self.port) if sys.platform.startswith("win") else None
+            hint = f"（占用 PID={pid}）" if pid else ""
+            self._emit_log(f"[ERROR] 端口 {self.port} 可能被占用{hint}：{e}")
             self.stopped.emit(1)
         except Exception:
-            self.log.emit("[ERROR] Flask 服务器异常退出：")
-            self.log.emit(traceback.format_exc())
+            self._emit_log("[ERROR] Flask 服务器异常退出：")
+            self._emit_log(traceback.format_exc())
             self.stopped.emit(1)
-        finally:
-            try:
-                if self._ctx is not None:
-                    self._ctx.pop()
-            except Exception:
-                pass
 
     def stop(self):
         if self._server is not None:
             try:
-                self.log.emit("[SERVER] 收到停止指令，正在关闭 Flask ...")
-                self._server.shutdown()
+                self._emit_log("[SERVER] 收到停止指令，正在关闭 Flask ...")
+                if self._is_waitress:
+                    self._server.close()
+                else:
+                    self._server.shutdown()
             except Exception as e:
-                self.log.emit(f"[WARN] 关闭服务器失败：{e}")
+                self._emit_log(f"[WARN] 关闭服务器失败：{e}")
+        if self._app is not None:
+            executor = self._app.extensions.get("uvd_executor")
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            listener = self._app.extensions.get("uvd_log_listener")
+            if listener is not None:
+                try:
+                    listener.stop()  # 把队列里剩的日志冲出去再停
+                except Exception:
+                    pass
 
 
 # ======================
@@ -405,9 +727,22 @@ class UvdGui(QWidget):
         self.log_box.setReadOnly(True)
         layout.addWidget(self.log_box)
 
+        # 定时整批拉取服务线程的日志：一批一次 append，不逐行跨线程发信号
+        self._log_timer = QTimer(self)
+        self._log_timer.setInterval(50)
+        self._log_timer.timeout.connect(self._flush_server_log)
+        self._log_timer.start()
+
     def append_log(self, text: str):
         self.log_box.append(text.rstrip("\n"))
 
+    def _flush_server_log(self):
+        t = self.server_thread
+        if t is not None:
+            batch = t.take_log_batch()
+            if batch:
+                self.log_box.append(batch)
+
     # ---- 槽函数 ----
 
     @Slot()
@@ -421,12 +756,8 @@ class UvdGui(QWidget):
         base = Path(self.workdir_edit.text() or default_workdir()).resolve()
         dl = base / "downloads"
         dl.mkdir(parents=True, exist_ok=True)
-        if sys.platform.startswith("win"):
-            os.startfile(str(dl))  # noqa
-        elif sys.platform == "darwin":
-            os.system(f'open "{dl}"')
-        else:
-            os.system(f'xdg-open "{dl}"')
+        # 各平台统一交给 Qt 打开，不经 shell（路径带空格/引号也安全）
+        QDesktopServices.openUrl(QUrl.fromLocalFile(str(dl)))
 
     @Slot()
     def start_server(self):
@@ -446,16 +777,7 @@ class UvdGui(QWidget):
             QMessageBox.critical(self, "端口错误", f"无效的端口号：{port_text}")
             return
 
-        # 端口占用检查
-        if not port_is_free("127.0.0.1", port):
-            pid = find_listening_pid_windows(port) if sys.platform.startswith("win") else None
-            msg = f"端口 {port} 可能已被占用。\n"
-            if pid:
-                msg += f"占用 PID = {pid}\n"
-            msg += "请更换端口或先关闭占用该端口的程序。"
-            QMessageBox.warning(self, "端口占用", msg)
-            # 可以允许继续启动（例如只是提示），这里选择直接返回：
-            return
+        # 端口占用不再预先探测：服务线程自己绑 socket，失败会在日志里给出提示
 
         self.append_log("========================================")
         self.append_log(f"[GUI] 即将启动 Flask 服务: http://127.0.0.1:{port}")
@@ -463,7 +785,6 @@ class UvdGui(QWidget):
         self.append_log("========================================")
 
         self.server_thread = FlaskServerThread(base_dir, "127.0.0.1", port)
-        self.server_thread.log.connect(self.append_log)
         self.server_thread.stopped.connect(self.on_server_stopped)
         self.server_thread.start()
 
@@ -479,11 +800,25 @@ class UvdGui(QWidget):
 
     @Slot(int)
     def on_server_stopped(self, code: int):
+        self._flush_server_log()  # 把线程退出前攒下的日志取干净
         self.append_log(f"[GUI] Flask 服务已退出，code={code}")
         self.btn_start.setEnabled(True)
         self.btn_stop.setEnabled(False)
         self.server_thread = None
 
+    def closeEvent(self, event):
+        # 线程池 worker 不是 daemon，且 shutdown() 打断不了跑着的
+        # ydl.download()——不硬退出的话，关窗后无窗口进程会一直活到
+        # 当前下载（可能几十分钟）结束
+        if self.server_thread:
+            try:
+                self.server_thread.stop()  # 关 socket、停日志监听器
+                self.server_thread.wait(3000)
+            except Exception:
+                pass
+        event.accept()
+        os._exit(0)
+
 
 # ======================
 # 入口